@@ -1,28 +1,78 @@
+import sys
+
+
 class Node:
+    # slotted, so a node carries no per-instance __dict__; the type names are interned,
+    # so every node of a production shares one string
+    __slots__ = ('type', 'children', 'leaf')
+
     def __init__(self, type: str, children: list = None, leaf=None):
-        self.type = type
+        self.type = sys.intern(type)
         assert isinstance(children, list) or children is None, "illegal when constructing {}".format(type)
         self.children = children if children else list()
         self.leaf = leaf
 
-    def traverse(self, indent=0):
-        padding = ' ' * indent
+    def preorder(self):
+        # yields (node, depth) parents first, with an explicit stack instead of recursion
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            stack.extend([(child, depth + 1) for child in reversed(node.children) if child is not None])
+
+    def postorder(self):
+        # yields (node, depth) children first
+        stack = [(self, 0, False)]
+        while stack:
+            node, depth, expanded = stack.pop()
+            if expanded:
+                yield node, depth
+                continue
+            stack.append((node, depth, True))
+            stack.extend([(child, depth + 1, False) for child in reversed(node.children) if child is not None])
+
+    def write(self, stream, indent=0, max_depth=None):
+        # pretty-prints into any text stream, subtrees deeper than max_depth are elided as "..."
         block = ' ' * 4
-        print(padding, "PRODUCTION: ", self.type, "{")
-        if self.children or self.leaf:
-            print(padding+block, "LEAF:", self.leaf)
-            # print()
-            # print(padding+block, "children:")
-            # print()
+        stack = [(self, indent, 0)]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                stream.write(item)
+                continue
+            node, indent, depth = item
+            padding = ' ' * indent
+            stream.write('%s PRODUCTION:  %s {\n' % (padding, node.type))
+            if node.children or node.leaf:
+                stream.write('%s LEAF: %s\n' % (padding + block, node.leaf))
+            stack.append('%s }\n' % padding)
+            if max_depth is not None and depth >= max_depth:
+                if any(child is not None for child in node.children):
+                    stream.write('%s ...\n' % (padding + block))
+                continue
+            for child in reversed(node.children):
+                if child is None:
+                    continue
+                stack.append('\n')
+                stack.append((child, indent + 4, depth + 1))
+
+    def traverse(self, indent=0, max_depth=None):
+        self.write(sys.stdout, indent, max_depth)
+
 
-            if self.children is not None:
-                for child in self.children:
-                    if child is None:
-                        continue
-                    child.traverse(indent=indent + 4)
-                    print()
+class Visitor:
+    # calls visit_<type>(node, depth) on every node of a tree, generic_visit when there is no such method
+    def visit(self, root, order='pre'):
+        walk = root.preorder() if order == 'pre' else root.postorder()
+        methods = {}
+        for node, depth in walk:
+            method = methods.get(node.type)
+            if method is None:
+                method = methods[node.type] = getattr(self, 'visit_' + node.type, self.generic_visit)
+            method(node, depth)
 
-        print(padding, "}")
+    def generic_visit(self, node, depth):
+        pass
 
 
 if __name__ == "__main__":
@@ -43,3 +93,5 @@ if __name__ == "__main__":
     n1_9 = Node("type1_9", children=[n123, n456, n789], leaf="n1_9")
 
     n1_9.traverse()
+    n1_9.traverse(max_depth=1)
+    print([node.leaf for node, depth in n1_9.postorder()])
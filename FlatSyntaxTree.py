@@ -0,0 +1,382 @@
+import io
+import mmap
+import struct
+import sys
+from array import array
+from collections import Counter
+from AbstractSyntaxTree import Node
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# type id of a None placeholder
+NONE = 0xFFFF
+
+
+class FlatTree:
+    # struct-of-arrays form of a Node tree, nodes are numbered in pre-order and the root is 0
+    # node i has type types[type_id[i]], leaf values[leaf_index[i]], and its children are
+    # first_child[i] followed by the chain of next_sibling links; -1 stands for none
+    # None placeholders (from empty productions) are dropped, unless built with placeholders=True:
+    # then they are kept as nodes of type id NONE, so that to_node() gives back the same children lists
+    def __init__(self):
+        self.types = []
+        self.type_ids = {}
+        self.type_id = array('H')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+        self.leaf_index = array('i')
+        self.values = []
+        self.value_ids = {}
+
+    def __len__(self):
+        return len(self.type_id)
+
+    def intern_type(self, type):
+        ID = self.type_ids.get(type)
+        if ID is None:
+            ID = self.type_ids[type] = len(self.types)
+            self.types.append(type)
+        return ID
+
+    def intern_value(self, value):
+        # equal leaves share one pool entry; list leaves are pooled as tuples
+        if value is None:
+            return -1
+        if isinstance(value, list):
+            value = tuple(value)
+        key = (value.__class__, value)  # keeps 1 and True apart
+        index = self.value_ids.get(key)
+        if index is None:
+            index = self.value_ids[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+    @classmethod
+    def from_node(cls, root, placeholders=False, nodes=None):
+        # with a nodes list, every Node (or placeholder) is appended to it, so nodes[i] is node i
+        tree = cls()
+        last_child = array('i')
+        stack = [(root, -1)]
+        while stack:
+            node, parent = stack.pop()
+            i = len(tree.type_id)
+            if nodes is not None:
+                nodes.append(node)
+            if node is None:
+                tree.type_id.append(NONE)
+                tree.leaf_index.append(-1)
+            else:
+                tree.type_id.append(tree.intern_type(node.type))
+                tree.leaf_index.append(tree.intern_value(node.leaf))
+            tree.first_child.append(-1)
+            tree.next_sibling.append(-1)
+            last_child.append(-1)
+            if parent >= 0:
+                if last_child[parent] < 0:
+                    tree.first_child[parent] = i
+                else:
+                    tree.next_sibling[last_child[parent]] = i
+                last_child[parent] = i
+            if node is not None:
+                stack.extend([(child, i) for child in reversed(node.children) if placeholders or child is not None])
+        return tree
+
+    def to_node(self):
+        nodes = self.to_nodes()
+        return nodes[0] if nodes else None
+
+    def to_nodes(self):
+        # the Node tree as a list of its nodes, nodes[i] being node i and nodes[0] the root
+        nodes = [None if type_id == NONE else Node(self.types[type_id], leaf=self.leaf(i))
+                 for i, type_id in enumerate(self.type_id)]
+        for i, node in enumerate(nodes):
+            child = self.first_child[i]
+            while child >= 0:
+                node.children.append(nodes[child])
+                child = self.next_sibling[child]
+        return nodes
+
+    def type(self, i):
+        ID = self.type_id[i]
+        return None if ID == NONE else self.types[ID]
+
+    def leaf(self, i):
+        index = self.leaf_index[i]
+        if index < 0:
+            return None
+        value = self.values[index]
+        return list(value) if isinstance(value, tuple) else value
+
+    def children(self, i):
+        child = self.first_child[i]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def preorder(self, root=0):
+        # yields (index, depth); nodes are stored in pre-order, so only depth needs a stack
+        stack = [(root, 0)]
+        first_child, next_sibling = self.first_child, self.next_sibling
+        while stack:
+            i, depth = stack.pop()
+            yield i, depth
+            sibling = next_sibling[i]
+            if sibling >= 0 and depth > 0:
+                stack.append((sibling, depth))
+            child = first_child[i]
+            if child >= 0:
+                stack.append((child, depth + 1))
+
+    def postorder(self, root=0):
+        stack = [(root, 0, False)]
+        while stack:
+            i, depth, expanded = stack.pop()
+            if expanded:
+                yield i, depth
+                continue
+            stack.append((i, depth, True))
+            stack.extend([(child, depth + 1, False) for child in reversed(list(self.children(i)))])
+
+    def find(self, type):
+        # indices of all nodes of a production type, in pre-order
+        ID = self.type_ids.get(type)
+        return [i for i, type_id in enumerate(self.type_id) if type_id == ID]
+
+    def count_types(self):
+        return Counter({self.types[ID]: count for ID, count in Counter(self.type_id).items() if ID != NONE})
+
+    def identifiers(self):
+        return [self.leaf(i) for i in self.find('identifier')]
+
+    def type_id_array(self):
+        # zero-copy numpy view of type_id, for vectorized queries such as (tree.type_id_array() == ID).sum()
+        if numpy is None:
+            raise ImportError('numpy is required for type_id_array()')
+        return numpy.frombuffer(self.type_id, dtype=numpy.uint16)
+
+    def save(self, path):
+        # writes the binary tree file described below, which TreeFile maps back in
+        with open(path, 'wb') as fo:
+            self.write(fo)
+
+    def to_bytes(self):
+        # the same binary tree as save(), as bytes, read back with TreeFile.from_bytes()
+        fo = io.BytesIO()
+        self.write(fo)
+        return fo.getvalue()
+
+    def write(self, fo):
+        # fo is a binary file object positioned at the start of the tree
+        n = len(self.type_id)
+        arrays = [self.first_child, self.next_sibling, self.leaf_index, self.type_id]
+        if sys.byteorder == 'big':
+            arrays = [array(a.typecode, a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        start = fo.tell()
+        fo.write(TREE_HEADER.pack(TREE_MAGIC, TREE_VERSION, len(self.types), n, len(self.values)))
+        for a in arrays:
+            fo.write(a.tobytes())
+        fo.write(b''.join([pack_string(type) for type in self.types]))
+        fo.write(bytes(-(fo.tell() - start) % TREE_COUNT.size))  # aligns the offsets
+        pool = [pack_value(value) for value in self.values]
+        offset = fo.tell() - start + TREE_COUNT.size * len(pool)
+        for chunk in pool:
+            fo.write(TREE_COUNT.pack(offset))
+            offset += len(chunk)
+        fo.write(b''.join(pool))
+
+
+# binary tree file (.sast):
+#   header   magic, version, number of types, number of nodes, number of values
+#   nodes    first_child, next_sibling and leaf_index as int32 arrays, then type_id as a uint16 array
+#   types    the type names, every string is a uint32 byte length followed by utf-8 bytes
+#   values   zero padding to a multiple of 4 bytes, the uint32 file offset of every value, then the values
+#            every value is a tag byte followed by: s a string, i an int written as a decimal string,
+#            f a float64, t a uint32 count and that many values (list leaves)
+# all numbers are little-endian
+TREE_MAGIC = b'SAST'
+TREE_VERSION = 1
+TREE_HEADER = struct.Struct('<4sHHII')
+TREE_COUNT = struct.Struct('<I')
+TREE_FLOAT = struct.Struct('<d')
+
+
+def pack_string(string):
+    string = string.encode('utf-8')
+    return TREE_COUNT.pack(len(string)) + string
+
+
+def read_string(view, offset):
+    length, = TREE_COUNT.unpack_from(view, offset)
+    offset += TREE_COUNT.size
+    return str(view[offset:offset + length], 'utf-8'), offset + length
+
+
+def pack_value(value):
+    if isinstance(value, str):
+        return b's' + pack_string(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return b'i' + pack_string(str(value))
+    if isinstance(value, float):
+        return b'f' + TREE_FLOAT.pack(value)
+    if isinstance(value, tuple):
+        return b't' + TREE_COUNT.pack(len(value)) + b''.join([pack_value(item) for item in value])
+    raise ValueError('cannot serialize a leaf of type %s' % value.__class__.__name__)
+
+
+class ValuePool:
+    # the leaf values of a TreeFile, each one decoded the first time it is read
+    def __init__(self, view, offsets):
+        self.view = view
+        self.offsets = offsets
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        value = self.cache.get(index)
+        if value is None:
+            value = self.cache[index] = self.unpack(self.offsets[index])[0]
+        return value
+
+    def unpack(self, offset):
+        # returns the value at offset and the offset right after it
+        tag, offset = self.view[offset], offset + 1
+        if tag == ord('s'):
+            return read_string(self.view, offset)
+        if tag == ord('i'):
+            digits, offset = read_string(self.view, offset)
+            return int(digits), offset
+        if tag == ord('f'):
+            return TREE_FLOAT.unpack_from(self.view, offset)[0], offset + TREE_FLOAT.size
+        count, = TREE_COUNT.unpack_from(self.view, offset)
+        offset += TREE_COUNT.size
+        items = []
+        for _ in range(count):
+            item, offset = self.unpack(offset)
+            items.append(item)
+        return tuple(items), offset
+
+
+class TreeFile(FlatTree):
+    # memory-maps a .sast file: the node arrays are zero-copy views into the file and every FlatTree query
+    # works on them directly; leaf values are decoded on first use, and node() materializes a subtree
+    # lazily, so a huge tree can be opened and walked in part without loading all of it
+    def __init__(self, path):
+        with open(path, 'rb') as fi:
+            self.mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        self.load(self.mm, path)
+
+    @classmethod
+    def from_bytes(cls, data):
+        # a TreeFile over a bytes object rather than a mapped file, such as one written by FlatTree.to_bytes()
+        tree = cls.__new__(cls)
+        tree.mm = None
+        tree.load(data, 'buffer')
+        return tree
+
+    def load(self, buffer, name):
+        magic, version, n_types, n, n_values = (TREE_HEADER.unpack_from(buffer, 0)
+                                                if len(buffer) >= TREE_HEADER.size else (None,) * 5)
+        if magic != TREE_MAGIC or version != TREE_VERSION:
+            if self.mm is not None:
+                self.mm.close()
+            raise ValueError('%s is not a version %d tree file' % (name, TREE_VERSION))
+        self.view = memoryview(buffer)
+        self.views = []
+        offset = TREE_HEADER.size
+        self.first_child, offset = self.array('i', offset, n)
+        self.next_sibling, offset = self.array('i', offset, n)
+        self.leaf_index, offset = self.array('i', offset, n)
+        self.type_id, offset = self.array('H', offset, n)
+        self.types = []
+        for _ in range(n_types):
+            type, offset = read_string(self.view, offset)
+            self.types.append(sys.intern(type))
+        self.type_ids = {type: ID for ID, type in enumerate(self.types)}
+        offset += -offset % TREE_COUNT.size
+        self.values = ValuePool(self.view, self.array('I', offset, n_values)[0])
+
+    def array(self, typecode, offset, n):
+        size = array(typecode).itemsize * n
+        if sys.byteorder == 'big':
+            a = array(typecode, bytes(self.view[offset:offset + size]))
+            a.byteswap()
+        else:
+            a = self.view[offset:offset + size].cast(typecode)
+            self.views.append(a)
+        return a, offset + size
+
+    def intern_type(self, type):
+        raise TypeError('a TreeFile is read-only')
+
+    intern_value = intern_type
+
+    def node(self, i=0):
+        return None if self.type_id[i] == NONE else LazyNode(self, i)
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        self.view.release()
+        if self.mm is not None:
+            self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LazyNode(Node):
+    # a Node backed by a TreeFile, its children are read from the file the first time they are asked for
+    # and may be replaced like those of any Node
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+        self.type = tree.types[tree.type_id[index]]
+        self.leaf = tree.leaf(index)
+
+    @property
+    def children(self):
+        try:
+            return Node.children.__get__(self)
+        except AttributeError:
+            children = [self.tree.node(child) for child in self.tree.children(self.index)]
+            Node.children.__set__(self, children)
+            return children
+
+    @children.setter
+    def children(self, children):
+        Node.children.__set__(self, children)
+
+
+def save_tree(root, path):
+    # None placeholders are kept, so the tree loads back exactly as it was
+    FlatTree.from_node(root, placeholders=True).save(path)
+
+
+if __name__ == "__main__":
+    n1 = Node("identifier", leaf="a")
+    n2 = Node("identifier", leaf="b")
+    n3 = Node("integer", leaf=1)
+    n12 = Node("identifier_table", children=[n1, n2], leaf=',')
+    root = Node("assignment", children=[n12, None, n3], leaf=[':='])
+
+    tree = FlatTree.from_node(root)
+    print(tree.types, list(tree.type_id), tree.values)
+    print(tree.count_types(), tree.identifiers())
+    tree.to_node().traverse()
+
+    save_tree(root, 'demo.sast')
+    with TreeFile('demo.sast') as loaded:
+        print(len(loaded), loaded.types, loaded.identifiers())
+        loaded.node().traverse()
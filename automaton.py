@@ -1,5 +1,41 @@
+import codecs
+import hashlib
+import os
+import struct
+import tempfile
+from array import array
+import lexer_generator
+from lexer_generator import escape, generate
+
+# compiled tables (.tab):
+#   header   magic, version, number of states, of rows, of classes, shift, initial state id
+#   tables   classes and accepting, 256 bytes each, then the n_rows << shift bytes of the transition table
+#   names    per state id: uint16 byte length followed by utf-8 bytes
+TABLES_MAGIC = b'SDFA'
+TABLES_VERSION = 1
+TABLES_HEADER = struct.Struct('<4sH5B')
+TABLES_NAME = struct.Struct('<H')
+
+# chars the table cannot index, above U+00FF, are encoded as a NUL byte, which is outside Sigma like them,
+# so that a buffer keeps one byte per char and every offset stays valid
+codecs.register_error('automaton-outside', lambda error: ('\0' * (error.end - error.start), error.end))
+
+
 class Automaton():
-    def __init__(self):
+    DEAD = 255
+    OTHER = 'other'  # stands for every char outside Sigma in transitions, see compile()
+
+    # trace levels
+    TRACE_OFF = 0
+    TRACE_TOKENS = 1  # one separator line per accepted token
+    TRACE_FULL = 2  # plus one line per character transition
+    TOKEN_TRACE = '----------------------%s----------------------\n\n'
+    CHAR_TRACE = '(%s,%s)-->%s, current-lex=%s\n'
+
+    def __init__(self, trace=TRACE_OFF, sink=None):
+        assert trace == self.TRACE_OFF or sink is not None, 'tracing needs a sink to write to'
+        self.trace = trace
+        self.sink = sink
         self.states = {'initial': 0}
         self.final_states = set()
         self.transition = {}
@@ -8,7 +44,7 @@ class Automaton():
         self.Sigma = 'abcdefghijklmnopqrstuvwxyz'
         self.Sigma += 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
         self.Sigma += '0123456789.'
-        self.Sigma += '+-*/,;:=_"\'\\<>{}()[]!?@#$%^&* \t'
+        self.Sigma += '+-*/,;:=_"\'\\<>{}()[]!?@#$%^&* \t\r\n'
         self.Sigma = set(self.Sigma)
 
     def append_state(self, state, final=None):
@@ -26,18 +62,240 @@ class Automaton():
     def start_over(self):
         self.current_state = 'initial'
         self.current_lex = ''
-        self.logs = []
+
+    def compile(self):
+        # dense transition table over character classes: chars that every state treats alike share a class,
+        # `classes` translates a byte to its class and the table has a row of 1 << shift columns per state id,
+        # DEAD where undefined
+        # class 0 holds the chars outside Sigma, which take the OTHER transitions
+        # the final states are numbered last and get no row: scanning stops as soon as it reaches one,
+        # so their rows would never be read, and each would only repeat the row of the state leading to it
+        # (every char to symbol_end, say); the rows left are all distinct for a minimized DFA,
+        # where two non-final states with the same row would have been merged
+        order = [state for state in self.states if state not in self.final_states]
+        order += [state for state in self.states if state in self.final_states]
+        n = len(order)
+        assert n < self.DEAD, 'too many states for a byte table'
+        self.states = {state: ID for ID, state in enumerate(order)}
+        self.state_names = order
+        self.n_rows = n - len(self.final_states)
+        # padded to 256 entries so that accepting[DEAD] is simply false
+        self.accepting = bytes(state in self.final_states for state in self.state_names).ljust(256, b'\0')
+
+        def column(ch):
+            return bytes(self.states[self.transition[key]] if key in self.transition else self.DEAD
+                         for key in ((state, ch) for state in order[:self.n_rows]))
+
+        other = column(self.OTHER)
+        class_of = {other: 0}
+        classes = bytearray(256)
+        for code in range(256):
+            ch = chr(code)
+            if ch in self.Sigma:
+                classes[code] = class_of.setdefault(column(ch), len(class_of))
+        self.classes = bytes(classes)
+        self.n_classes = len(class_of)
+        self.shift = max(1, (self.n_classes - 1).bit_length())
+        table = array('B', [self.DEAD]) * (self.n_rows << self.shift)
+        for entries, ID in class_of.items():
+            for state, new_state in enumerate(entries):
+                table[(state << self.shift) | ID] = new_state
+        self.table = table
+        self.initial_id = self.states['initial']
+        return table
+
+    def save(self, path):
+        # writes the compiled tables, through a temporary file so that a concurrent load never sees half of them
+        data = [TABLES_HEADER.pack(TABLES_MAGIC, TABLES_VERSION, len(self.state_names), self.n_rows,
+                                   self.n_classes, self.shift, self.initial_id),
+                self.classes, self.accepting, self.table.tobytes()]
+        for name in self.state_names:
+            name = name.encode('utf-8')
+            data += [TABLES_NAME.pack(len(name)), name]
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.fchmod(f.fileno(), 0o644)  # mkstemp makes it private, the tables are shared by every user
+                f.write(b''.join(data))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def load(self, path):
+        # the inverse of save() followed by compile(), returns False if path holds no valid tables
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, n, n_rows, n_classes, shift, initial_id = TABLES_HEADER.unpack_from(data, 0)
+            if magic != TABLES_MAGIC or version != TABLES_VERSION:
+                return False
+            offset = TABLES_HEADER.size
+            classes, accepting = data[offset:offset + 256], data[offset + 256:offset + 512]
+            offset += 512
+            table = array('B', data[offset:offset + (n_rows << shift)])
+            offset += n_rows << shift
+            names = []
+            for _ in range(n):
+                length, = TABLES_NAME.unpack_from(data, offset)
+                offset += TABLES_NAME.size
+                names.append(str(data[offset:offset + length], 'utf-8'))
+                offset += length
+            if offset != len(data) or len(table) != n_rows << shift:
+                return False
+        except (OSError, struct.error, UnicodeDecodeError):
+            return False
+        self.states = {state: ID for ID, state in enumerate(names)}
+        self.state_names, self.n_rows, self.initial_id = names, n_rows, initial_id
+        self.final_states = set(names[n_rows:])
+        self.classes, self.n_classes, self.shift = classes, n_classes, shift
+        self.accepting, self.table = accepting, table
+        self.transition = None  # rebuilt from the table by decompile() if process() or check_mapping() need it
+        return True
+
+    def decompile(self):
+        # the transition dict of a loaded automaton, read back from its table
+        # the final states have no row, they keep every char to themselves as generate() has them do
+        names, classes, table, shift = self.state_names, self.classes, self.table, self.shift
+        self.transition = {}
+        for ID, state in enumerate(names):
+            row = ID << shift
+            for ch in self.Sigma:
+                self.transition[(state, ch)] = names[table[row | classes[ord(ch)]]] if ID < self.n_rows else state
+            self.transition[(state, self.OTHER)] = names[table[row]] if ID < self.n_rows else state
+
+    def translate(self, text):
+        # the class of every char of text, as bytes
+        if isinstance(text, str):
+            text = text.encode('latin-1', 'automaton-outside')
+        return text.translate(self.classes)
+
+    def signature(self):
+        # hash of the compiled tables, changes whenever the tokens the automaton produces may change
+        digest = hashlib.sha1(self.table.tobytes())
+        digest.update(self.classes)
+        digest.update(self.accepting)
+        digest.update(' '.join(self.state_names).encode('utf-8'))
+        return digest.hexdigest()
+
+    def scan(self, data, pos=0):
+        # run the compiled table from the initial state, starting at data[pos]
+        # returns (state id, start of lexeme, position of the char that reached the state)
+        # a non-accepting state id means data ran out before a token was accepted
+        classes = self.translate(data)
+        table, accepting, initial, shift = self.table, self.accepting, self.initial_id, self.shift
+        state, start, end = initial, pos, len(classes)
+        while pos < end:
+            new_state = table[(state << shift) | classes[pos]]
+            if new_state == self.DEAD:
+                raise KeyError('transition mapping: (%s, %r) |--> new_state does not exist'
+                               % (self.state_names[state], data[pos:pos + 1]))
+            if accepting[new_state]:
+                return new_state, start, pos
+            if new_state == initial:
+                start = pos + 1
+            state = new_state
+            pos += 1
+        return state, start, pos
+
+    def tokenize(self, text, eof=True, base=0, carry=None):
+        # maximal munch over a buffer, yielding (lexeme, accepted_state, start, end)
+        # a final state is reached on the first char after the lexeme, which is rolled back
+        # and read again from the initial state; 'illegal' consumes its offending char instead
+        # with eof=False the token still open at the end of text is not flushed: the generator returns
+        # a carry, (state, the pieces of its lexeme so far, its start), or None if no token is open,
+        # and passing it along with the next buffer resumes the scan where it stopped, so a token
+        # spanning many buffers is scanned once and its lexeme joined once
+        # base is added to the reported offsets, for text that is a slice of a longer stream
+        classes = self.translate(text)
+        table, accepting, names, shift = self.table, self.accepting, self.state_names, self.shift
+        initial, illegal, DEAD = self.initial_id, self.states.get('illegal'), self.DEAD
+        tokens, full, sink = self.trace >= self.TRACE_TOKENS, self.trace >= self.TRACE_FULL, self.sink
+        state, pieces, first = carry or (initial, None, None)
+        start, pos, end = 0, 0, len(classes)
+        while pos < end:
+            new_state = table[(state << shift) | classes[pos]]
+            if full:
+                self.__trace_transition(text, state, new_state, start, pos, pieces)
+            if accepting[new_state]:
+                if new_state == illegal:
+                    pos += 1
+                if pieces is None:
+                    lexeme, first = text[start:pos], base + start
+                else:
+                    pieces.append(text[start:pos])
+                    lexeme, pieces = text[:0].join(pieces), None
+                if tokens:
+                    sink.write(self.TOKEN_TRACE % lexeme)
+                yield lexeme, names[new_state], first, base + pos
+                state, start = initial, pos
+                continue
+            if new_state == initial:
+                start = pos + 1
+            elif new_state == DEAD:
+                raise KeyError('transition mapping: (%s, %r) |--> new_state does not exist'
+                               % (names[state], text[pos:pos + 1]))
+            state = new_state
+            pos += 1
+        if state == initial:
+            return None
+        if pieces is None:
+            pieces, first = [], base + start
+        pieces.append(text[start:end])
+        if not eof:
+            return state, pieces, first
+        # end of input acts as a trailing blank
+        new_state = table[(state << shift) | self.classes[ord(' ')]]
+        if not accepting[new_state]:
+            new_state = illegal
+        lexeme = text[:0].join(pieces)
+        if tokens:
+            sink.write(self.TOKEN_TRACE % lexeme)
+        yield lexeme, names[new_state], first, base + end
+        return None
+
+    def tokenize_stream(self, stream, chunk_size=1 << 16, on_chunk=None):
+        # tokenize a file object chunk by chunk, in memory bounded by chunk_size plus the longest token
+        # the token left open at the end of a chunk is carried over and resumed with the next one
+        # on_chunk, if given, is called before each read, which may block on a slow stream
+        carry, base = None, 0
+        while True:
+            if on_chunk is not None:
+                on_chunk()
+            chunk = stream.read(chunk_size)
+            carry = yield from self.tokenize(chunk, eof=not chunk, base=base, carry=carry)
+            if not chunk:
+                return
+            base += len(chunk)
+
+    def __trace_transition(self, text, state, new_state, start, pos, pieces):
+        names = self.state_names
+        if new_state == self.initial_id or self.accepting[new_state]:
+            lex = text[start:pos]
+        else:
+            lex = text[start:pos + 1]
+        if pieces:
+            lex = text[:0].join(pieces) + lex
+        ch = text[pos:pos + 1]
+        if ch in ('\n', '\r'):
+            ch = ' '  # keep one record per line
+        self.sink.write(self.CHAR_TRACE % (names[state], ch, names[new_state], lex))
 
     def process(self, ch):
+        if self.transition is None:
+            self.decompile()
         state = self.current_state
-        new_state = self.transition[(state, ch)]
+        new_state = self.transition[(state, ch if ch in self.Sigma else self.OTHER)]
         if new_state not in self.final_states and new_state != 'initial':
             self.current_lex += ch
         self.current_state = new_state
-        self.logs.append((state, ch, new_state, self.current_lex))
+        if self.trace >= self.TRACE_FULL:
+            self.sink.write(self.CHAR_TRACE % (state, ch, new_state, self.current_lex))
         return new_state in self.final_states
 
     def check_mapping(self):
+        if self.transition is None:
+            self.decompile()
         flag = True
         for state in self.states:
             for sigma in self.Sigma:
@@ -47,157 +305,57 @@ class Automaton():
         return flag
 
 
+def tables_path(tokens, Sigma):
+    # automaton_<signature>.tab next to this file, the signature hashing everything the tables are generated from:
+    # the tokens (keywords included), the alphabet and the generator itself
+    digest = hashlib.sha1(repr(tokens).encode('utf-8'))
+    digest.update(''.join(sorted(Sigma)).encode('utf-8'))
+    with open(lexer_generator.__file__, 'rb') as f:
+        digest.update(f.read())
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'automaton_%s.tab' % digest.hexdigest()[:16])
+
+
+# the tokens of the SIMPLE language, in priority order, as (accepted_state, pattern, illegal_follow)
+# a constant running straight into a letter, an underscore or a second dot, as in 12ab or 1.5., is illegal
+TOKENS = [
+    ('identifier_end', r'[A-Za-z_][A-Za-z0-9_]*', None),
+    ('constant_end', r'[0-9]+(\.[0-9]*)?|\.[0-9]+', r'[A-Za-z_.]'),
+    ('str_end', r"'[^']*'", None),
+    ('comment_end', r'/\*([^*]|\*+[^*/])*\*+/', None),
+    ('symbol_end', r'<=|<>|>=|==|:=|//|\*\*|[<>=.,:/;+\-*()\[\]{}]', None),
+]
+
+
 class ParserAutomaton(Automaton):
-    def __init__(self):
-        super().__init__()
-        self.__append_states()
-        self.__append_transitions()
+    # the minimal DFA of TOKENS, generated by lexer_generator
+    # it accepts the keywords as keyword_end ahead of identifier_end: they become a trie of states
+    # along the identifier path, so telling a keyword from an identifier costs no lookup after lexing
+    # keywords is required since TokenCollection relies on it, pass () for an automaton without any
+    # generating the tables is slow, so they are loaded from the automaton_<signature>.tab that the first
+    # automaton built from the same tokens wrote, see tables_path(); as the keywords are part of the tokens,
+    # each keyword list has its own file, which grows with the trie
+    def __init__(self, keywords, trace=Automaton.TRACE_OFF, sink=None):
+        super().__init__(trace, sink)
+        tokens = TOKENS
+        if keywords:
+            # sorted, so that the tables of a keyword list are found again whatever its order and repetitions
+            keywords = sorted(set(keywords))
+            tokens = [('keyword_end', '|'.join(escape(keyword) for keyword in keywords), None)] + TOKENS
+        path = tables_path(tokens, self.Sigma)
+        if self.load(path):
+            return
+        generate(self, tokens)
         assert self.check_mapping()  # check that transition mapping: Q x Sigma -> Q is fully defined
-
-    def __append_states(self):
-        self.append_state('identifier')
-        self.append_state('constant without dot')
-        self.append_state('constant with dot')
-        self.append_state("'")
-        self.append_state("'str")
-        self.append_state("'str'")  # pre-'end'
-
-        # if starting with a single symbol
-        self.append_state('<')
-        self.append_state('>')
-        self.append_state('=')
-        self.append_state('.')
-        self.append_state(',')
-        self.append_state(':')
-        self.append_state('/')
-        self.append_state(';')  # pre-'end'
-        self.append_state('+')  # pre-'end'
-        self.append_state('-')  # pre-'end'
-        self.append_state('*')
-        self.append_state('(')  # pre-'end'
-        self.append_state(')')  # pre-'end'
-        self.append_state('[')  # pre-'end'
-        self.append_state(']')  # pre-'end'
-        self.append_state('{')  # pre-'end'
-        self.append_state('}')  # pre-'end'
-
-        # if starting with two symbols
-        self.append_state('<=')  # pre-'end'
-        self.append_state('<>')  # pre-'end'
-        self.append_state('>=')  # pre-'end'
-        self.append_state('==')  # pre-'end'
-        self.append_state(':=')  # pre-'end'
-        self.append_state('/*')  # pre-'end'
-        self.append_state('//')  # pre-'end'
-        self.append_state('**')  # pre-'end'
-
-        self.append_state('illegal', final=True)
-        self.append_state('identifier_end', final=True)
-        self.append_state('constant_end', final=True)
-        self.append_state('str_end', final=True)
-        self.append_state('symbol_end', final=True)
-        self.append_state('comment_end', final=True)
-
-    def __append_transitions(self):
-        alphabetic = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
-        digit = set('1234567890')
-        digit_dot = set('1234567890.')
-
-        alphabetic_underscore = alphabetic.copy()
-        alphabetic_underscore.add('_')
-
-        alphanumeric = alphabetic.copy()
-        alphanumeric.update('1234567890')
-
-        alphanumeric_underscore = alphanumeric.copy()
-        alphabetic_underscore.add('_')
-
-        self.append_transition('initial', 'identifier', alphabetic_underscore)
-        self.append_transition('initial', 'initial', set(' \t'))
-        self.append_transition('initial', 'constant without dot', digit)
-        self.append_transition('initial', 'constant with dot', set('.'))
-        self.append_transition('initial', "'", set("'"))
-        self.append_transition('initial', '<', set('<'))
-        self.append_transition('initial', '>', set('>'))
-        self.append_transition('initial', '=', set('='))
-        self.append_transition('initial', '.', set('.'))
-        self.append_transition('initial', ',', set(','))
-        self.append_transition('initial', ':', set(':'))
-        self.append_transition('initial', '/', set('/'))
-        self.append_transition('initial', ';', set(';'))
-        self.append_transition('initial', '+', set('+'))
-        self.append_transition('initial', '-', set('-'))
-        self.append_transition('initial', '*', set('*'))
-        self.append_transition('initial', '(', set('('))
-        self.append_transition('initial', ')', set(')'))
-        self.append_transition('initial', '[', set('['))
-        self.append_transition('initial', ']', set(']'))
-        self.append_transition('initial', '{', set('{'))
-        self.append_transition('initial', '}', set('}'))
-        self.append_transition('initial', 'illegal', self.Sigma - alphanumeric - set("_'<>=,.:/;+-*()[]{} \t"))
-
-        self.append_transition('identifier', 'identifier', alphanumeric_underscore)
-        self.append_transition('identifier', 'identifier_end', self.Sigma - alphanumeric_underscore)
-
-        self.append_transition('constant without dot', 'constant without dot', digit)
-        self.append_transition('constant without dot', 'constant with dot', set('.'))
-        self.append_transition('constant without dot', 'illegal', alphabetic_underscore)
-        self.append_transition('constant without dot', 'constant_end', self.Sigma - digit_dot - alphanumeric_underscore)
-        self.append_transition('.', 'constant with dot', digit)
-        self.append_transition('constant with dot', 'constant with dot', digit)
-        self.append_transition('constant with dot', 'illegal', alphabetic_underscore | set('.'))
-        self.append_transition('constant with dot', 'constant_end', self.Sigma - digit_dot - alphanumeric_underscore)
-
-        self.append_transition("'", "'str", self.Sigma - set("'"))
-        self.append_transition("'", "'str'", set("'"))
-        self.append_transition("'str", "'str", self.Sigma - set("'"))
-        self.append_transition("'str", "'str'", set("'"))
-        self.append_transition("'str'", 'str_end', self.Sigma)
-
-        self.append_transition('<', '<=', set('='))
-        self.append_transition('<', '<>', set('>'))
-        self.append_transition('<', 'symbol_end', self.Sigma - set('=>'))
-        self.append_transition('>', '>=', set('>'))
-        self.append_transition('>', 'symbol_end', self.Sigma - set('>'))
-        self.append_transition('=', '==', set('='))
-        self.append_transition('=', 'symbol_end', self.Sigma - set('='))
-        self.append_transition(':', ':=', set('='))
-        self.append_transition(':', 'symbol_end', self.Sigma - set('='))
-        self.append_transition('/', '//', set('/'))
-        self.append_transition('/', '/*', set('*'))
-        self.append_transition('/', 'symbol_end', self.Sigma - set('/*'))
-        self.append_transition('*', '**', set('*'))
-        self.append_transition('*', 'symbol_end', self.Sigma - set('*'))
-        self.append_transition('.', 'symbol_end', self.Sigma - digit)
-
-        self.append_transition(',', 'symbol_end', self.Sigma)
-        self.append_transition(';', 'symbol_end', self.Sigma)
-        self.append_transition('+', 'symbol_end', self.Sigma)
-        self.append_transition('-', 'symbol_end', self.Sigma)
-        self.append_transition('(', 'symbol_end', self.Sigma)
-        self.append_transition(')', 'symbol_end', self.Sigma)
-        self.append_transition('[', 'symbol_end', self.Sigma)
-        self.append_transition(']', 'symbol_end', self.Sigma)
-        self.append_transition('{', 'symbol_end', self.Sigma)
-        self.append_transition('}', 'symbol_end', self.Sigma)
-        self.append_transition('<=', 'symbol_end', self.Sigma)
-        self.append_transition('<>', 'symbol_end', self.Sigma)
-        self.append_transition('>=', 'symbol_end', self.Sigma)
-        self.append_transition('==', 'symbol_end', self.Sigma)
-        self.append_transition(':=', 'symbol_end', self.Sigma)
-        self.append_transition('/*', 'symbol_end', self.Sigma)
-        self.append_transition('//', 'symbol_end', self.Sigma)
-        self.append_transition('**', 'symbol_end', self.Sigma)
-
-        self.append_transition('illegal', 'illegal', self.Sigma)
-        self.append_transition('identifier_end', 'identifier_end', self.Sigma)
-        self.append_transition('constant_end', 'constant_end', self.Sigma)
-        self.append_transition('str_end', 'str_end', self.Sigma)
-        self.append_transition('symbol_end', 'symbol_end', self.Sigma)
-        self.append_transition('comment_end', 'comment_end', self.Sigma)
+        self.compile()
+        try:
+            self.save(path)
+        except OSError:
+            pass  # a read-only install regenerates the tables every time
 
 
 if __name__ == "__main__":
-    parser = ParserAutomaton()
+    parser = ParserAutomaton(['begin', 'end'])
     print(parser.Sigma)
     print(parser.states)
+    print(parser.scan('count := count + 1;'))
+    print(list(parser.tokenize('begin count := count + 1; ending end')))
@@ -0,0 +1,118 @@
+import argparse
+import glob
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from automaton import ParserAutomaton
+from cache import token_cache
+from token_collection import TokenCollection
+
+# per-process state, built once by the pool initializer and reused for every file
+worker = {}
+
+
+def init_worker(mode, keywords, cache_dir=None, cache_size=64 << 20):
+    worker['keywords'] = keywords
+    if mode == 'lex':
+        worker['automaton'] = ParserAutomaton(keywords)
+        worker['cache'] = token_cache(cache_dir, worker['automaton'], keywords, cache_size) if cache_dir else None
+    else:
+        from simple_analyzer import SimpleCompiler, analysis_cache
+        cache = analysis_cache(cache_dir, cache_size) if cache_dir else None
+        worker['analyzer'] = SimpleCompiler(cache=cache)
+
+
+def lex_file(path):
+    # writes <name>_together.lex and <name>.set next to the source, returns its symbol table
+    collection = TokenCollection(worker['keywords'], None, None)
+    cache, tokens = worker['cache'], None
+    try:
+        if cache:
+            with open(path, 'rb') as fb:
+                source = fb.read()
+            tokens = cache.get(source)
+        if tokens is None:
+            # on a cache miss the bytes already read are decoded as open() would, newlines included,
+            # rather than reading the file a second time
+            fi = io.TextIOWrapper(io.BytesIO(source)) if cache else open(path)
+            with fi:
+                lexed = [] if cache else None
+                for lexeme, state, start, end in worker['automaton'].tokenize_stream(fi):
+                    if state == 'illegal':
+                        raise KeyError('illegal state encountered at %d: %s' % (start, lexeme))
+                    collection.append(lexeme, state)
+                    if cache:
+                        lexed.append((lexeme, state))
+            if cache:
+                cache.put(source, lexed)
+        else:
+            for lexeme, state in tokens:
+                collection.append(lexeme, state)
+    except Exception as e:  # one bad file must not take the rest of the batch down with it
+        return path, len(collection.list), {}, str(e) or e.__class__.__name__
+    name = os.path.splitext(path)[0]
+    collection.write_list(name + '_together.lex')
+    collection.write_set(name + '.set')
+    table = {collection.ID2type[ID]: list(collection.set[ID]) for ID in collection.set}
+    return path, len(collection.list), table, None
+
+
+def parse_file(path):
+    # returns the declared identifiers of a source, scope by scope
+    try:
+        with open(path) as fi:
+            toks, symbols, result = worker['analyzer'].analyze(fi)
+    except Exception as e:
+        return path, 0, {}, str(e) or e.__class__.__name__
+    error = None if result is not None else 'syntax error'
+    return path, len(toks), {'identifier_end': [symbol.name for symbol in symbols]}, error
+
+
+def find_sources(target):
+    pattern = os.path.join(target, '*.simple') if os.path.isdir(target) else target
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def run(paths, mode, keywords, jobs=None, cache_dir=None, cache_size=64 << 20):
+    # the global summary is merged in path order, so it does not depend on which worker finishes first
+    summary = TokenCollection(keywords, None, None)
+    failures = []
+    jobs = jobs or os.cpu_count()
+    if mode == 'parse':
+        from simple_analyzer import SimpleCompiler
+        SimpleCompiler()  # writes the cached PLY tables once, before the workers race to load them
+    else:
+        ParserAutomaton(keywords)  # likewise the automaton tables of this keyword list
+    chunksize = max(1, len(paths) // (jobs * 4))
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(mode, keywords, cache_dir, cache_size)) as pool:
+        task = lex_file if mode == 'lex' else parse_file
+        for path, n_tokens, table, error in pool.map(task, paths, chunksize=chunksize):
+            print('%s: %d tokens%s' % (path, n_tokens, ', ' + error if error else ''))
+            if error:
+                failures.append(path)
+            for accepted_state, lexemes in table.items():
+                interned = summary.set[summary.type2ID[accepted_state]]
+                for lexeme in lexemes:
+                    interned.intern(lexeme)
+    return summary, failures
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("target", help='directory of .simple files, or a glob pattern')
+    arg_parser.add_argument("--mode", choices=['lex', 'parse'], default='lex',
+                            help='lex with ParserAutomaton, or lex and parse with simple_analyzer')
+    arg_parser.add_argument("--jobs", type=int, default=None, help='number of worker processes')
+    arg_parser.add_argument("--summary", default='batch.set', help='path of the merged symbol table')
+    arg_parser.add_argument("--keywords", default='keywords.txt', help='path to the keyword list')
+    arg_parser.add_argument("--cache", default=None, help='directory of cached results, reused for unchanged sources')
+    arg_parser.add_argument("--cache-size", type=int, default=64, help='size limit of the cache directory, in MB')
+    opt = arg_parser.parse_args()
+
+    with open(opt.keywords) as fk:
+        keywords = ''.join(fk.readlines()).split()
+
+    paths = find_sources(opt.target)
+    summary, failures = run(paths, opt.mode, keywords, opt.jobs, opt.cache, opt.cache_size << 20)
+    summary.write_set(opt.summary)
+    print('%d files, %d failed, merged symbol table written to %s' % (len(paths), len(failures), opt.summary))
@@ -0,0 +1,283 @@
+import argparse
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from automaton import ParserAutomaton
+from token_collection import TokenCollection
+from FlatSyntaxTree import FlatTree
+from simple_analyzer import SimpleCompiler
+from symbol_table import SymbolTable
+
+
+class ProgramGenerator:
+    # random programs in the subset of SIMPLE that simple_analyzer accepts:
+    # `statements` clauses in the program body, structured clauses nested up to `depth` levels,
+    # each clause nesting with probability `nest` and compound clauses holding up to `fanout` clauses,
+    # `identifiers` distinct integer variables, string literals of `string_length` characters,
+    # and write clauses making up `writes` of the simple clauses
+    LETTERS = 'abcdefghijklmnopqrstuvwxyz '
+
+    def __init__(self, statements=1000, depth=3, nest=0.2, fanout=3, identifiers=20, string_length=8,
+                 writes=0.15, seed=0):
+        self.statements = statements
+        self.depth = depth
+        self.nest = nest
+        self.fanout = fanout
+        self.names = ['v%d' % i for i in range(max(1, identifiers))]
+        self.string_length = string_length
+        self.writes = writes
+        self.random = random.Random(seed)
+
+    def program(self):
+        names = self.names
+        lines = ['program bench', "constant limit = 10; greeting = %s;" % self.string(), 'var']
+        for i in range(0, len(names), 16):
+            lines.append('    %s: integer;' % ', '.join(names[i:i + 16]))
+        lines += ['    table: array [10] of integer;', '    flag: bool;',
+                  'procedure work(n: integer)', 'var t: integer;', 'begin', '    t := n;']
+        lines.append(';\n'.join(['    ' + self.statement(self.depth) for _ in range(3)]))
+        lines += ['end', 'begin']
+        clauses = []
+        for i in range(self.statements):
+            clause = self.statement(self.depth)
+            if i % 20 == 0:
+                clause = '/* clause %d */ %s' % (i, clause)
+            clauses.append('    ' + clause)
+        lines.append(';\n'.join(clauses))
+        lines.append('end')
+        return '\n'.join(lines) + '\n'
+
+    def string(self):
+        return "'%s'" % ''.join(self.random.choice(self.LETTERS) for _ in range(self.string_length))
+
+    def name(self):
+        return self.random.choice(self.names)
+
+    def expression(self, operands=None):
+        operands = operands or self.random.randint(1, 4)
+        text = self.operand()
+        for _ in range(operands - 1):
+            text += ' %s %s' % (self.random.choice('+-*/'), self.operand())
+        return text
+
+    def operand(self):
+        roll = self.random.random()
+        if roll < 0.5:
+            return self.name()
+        if roll < 0.85:
+            return str(self.random.randint(0, 999))
+        return '(%s)' % self.expression(2)
+
+    def condition(self):
+        relation = self.random.choice(['<', '<=', '>', '>=', '=', '<>'])
+        return '(%s) %s (%s)' % (self.expression(), relation, self.expression())
+
+    def statement(self, depth):
+        if depth > 0 and self.random.random() < self.nest:
+            return self.structured(depth - 1)
+        roll = self.random.random()
+        if roll < self.writes:
+            return 'write(%s, %s)' % (self.string(), self.name())
+        roll = (roll - self.writes) / (1 - self.writes)
+        if roll < 0.6:
+            return '%s := %s' % (self.name(), self.expression())
+        if roll < 0.75:
+            return 'table[%d] := %s' % (self.random.randint(0, 9), self.expression())
+        if roll < 0.85:
+            return 'flag := %s' % self.condition()
+        if roll < 0.95:
+            return 'call work(%s)' % self.expression()
+        return 'read(%s)' % self.name()
+
+    def structured(self, depth):
+        kind = self.random.choice(['if', 'while', 'for', 'repeat', 'compound'])
+        if kind == 'if':
+            text = 'if %s then %s' % (self.condition(), self.statement(depth))
+            if self.fanout > 1 and self.random.random() < 0.3:
+                text += ' else %s' % self.statement(depth)
+            return text
+        if kind == 'while':
+            return 'while %s do %s' % (self.condition(), self.statement(depth))
+        if kind == 'for':
+            return 'for %s := 1 to limit do %s' % (self.name(), self.statement(depth))
+        if kind == 'repeat':
+            return 'repeat %s until %s' % (self.statement(depth), self.condition())
+        clauses = [self.statement(depth) for _ in range(self.random.randint(1, self.fanout))]
+        return 'begin %s end' % '; '.join(clauses)
+
+
+# workload shapes, each scaled by --size
+SHAPES = {
+    'long': lambda size: dict(statements=size, depth=2, nest=0.1),
+    'deep': lambda size: dict(statements=max(1, size // 50), depth=50, nest=1.0, fanout=1),
+    'wide': lambda size: dict(statements=size, depth=1, identifiers=size),
+    'strings': lambda size: dict(statements=size, depth=1, string_length=200, writes=0.8),
+}
+
+
+class NullSymbols:
+    # stands in for the SymbolTable, so that parsing can be timed without building one
+    def __init__(self):
+        self.scopes = [SymbolTable().scopes[0]]
+
+    def ignore(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        return self.ignore
+
+
+def measure(function, repeat):
+    # best of `repeat` timed runs, then one more under tracemalloc for the peak of memory allocated
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+        del result
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def bench(text, keywords, repeat):
+    automaton = ParserAutomaton(keywords)
+    compiler = SimpleCompiler()
+    lexer, parser = compiler.lexer, compiler.parser
+    stages = {}
+
+    def record(stage, seconds, peak, tokens=None, nodes=None):
+        stages[stage] = {'seconds': seconds, 'peak_bytes': peak}
+        if tokens is not None:
+            stages[stage]['tokens_per_s'] = tokens / seconds if seconds else None
+        if nodes is not None:
+            stages[stage]['nodes_per_s'] = nodes / seconds if seconds else None
+
+    def lex_automaton():
+        return list(automaton.tokenize(text))
+
+    def token_collection():
+        collection = TokenCollection(keywords, None, None)
+        for lexeme, state, start, end in tokens:
+            collection.append(lexeme, state)
+        return collection
+
+    def lex_ply():
+        lexer.lineno = 1
+        lexer.input(text)
+        return list(lexer)
+
+    def parse(symbols):
+        lexer.symbols = symbols()
+        return parser.parse(lexer=lexer, tokenfunc=functools.partial(next, iter(ply_tokens), None))
+
+    seconds, peak, tokens = measure(lex_automaton, repeat)
+    illegal = [start for lexeme, state, start, end in tokens if state == 'illegal']
+    if illegal:
+        raise ValueError('the generated program has an illegal token at %d' % illegal[0])
+    record('lex_automaton', seconds, peak, len(tokens))
+    seconds, peak, collection = measure(token_collection, repeat)
+    record('token_collection', seconds, peak, len(tokens))
+    seconds, peak, ply_tokens = measure(lex_ply, repeat)
+    record('lex_ply', seconds, peak, len(ply_tokens))
+
+    # parse covers the grammar actions and AST construction, symbol_table is what the SymbolTable adds
+    seconds, peak, root = measure(lambda: parse(NullSymbols), repeat)
+    if root is None:
+        raise ValueError('the generated program does not parse')
+    n_nodes = sum(1 for _ in root.preorder())
+    record('parse', seconds, peak, len(ply_tokens), n_nodes)
+    full_seconds, full_peak, root = measure(lambda: parse(SymbolTable), repeat)
+    record('symbol_table', max(0.0, full_seconds - seconds), max(0, full_peak - peak))
+    seconds, peak, tree = measure(lambda: FlatTree.from_node(root, placeholders=True), repeat)
+    record('ast_flatten', seconds, peak, nodes=n_nodes)
+    return {'bytes': len(text.encode('utf-8')), 'lines': text.count('\n'), 'tokens': len(ply_tokens),
+            'nodes': n_nodes, 'symbols': len(lexer.symbols), 'stages': stages}
+
+
+def compare(results, baseline, threshold):
+    # prints the time ratio of every stage against a baseline run, returns the stages that slowed down
+    regressions = []
+    if (results['size'], results['seed']) != (baseline['size'], baseline['seed']):
+        print('the baseline used --size %d --seed %d, the timings are not comparable' % (baseline['size'],
+                                                                                          baseline['seed']))
+    for shape, result in results['shapes'].items():
+        old_shape = baseline['shapes'].get(shape)
+        if old_shape is None:
+            continue
+        for stage, entry in result['stages'].items():
+            old = old_shape['stages'].get(stage)
+            if not old or not old['seconds']:
+                continue
+            ratio = entry['seconds'] / old['seconds']
+            flag = ''
+            if ratio > 1 + threshold and stage != 'symbol_table':  # a difference of two timings, too noisy
+                regressions.append((shape, stage, ratio))
+                flag = '  <-- regression'
+            print('%-8s %-16s %6.2fx%s' % (shape, stage, ratio, flag))
+    return regressions
+
+
+def report(results):
+    for shape, result in results['shapes'].items():
+        print('%s: %d bytes, %d tokens, %d nodes' % (shape, result['bytes'], result['tokens'], result['nodes']))
+        for stage, entry in result['stages'].items():
+            rates = []
+            if entry.get('tokens_per_s'):
+                rates.append('%.0f tokens/s' % entry['tokens_per_s'])
+            if entry.get('nodes_per_s'):
+                rates.append('%.0f nodes/s' % entry['nodes_per_s'])
+            print('    %-16s %9.2f ms %9.1f KB peak  %s' % (stage, entry['seconds'] * 1000,
+                                                          entry['peak_bytes'] / 1024, ', '.join(rates)))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--shapes", nargs='+', choices=SHAPES, default=list(SHAPES), help='workloads to run')
+    arg_parser.add_argument("--size", type=int, default=2000, help='number of clauses (or variables) per workload')
+    arg_parser.add_argument("--repeat", type=int, default=3, help='timed runs per stage, the best one is kept')
+    arg_parser.add_argument("--seed", type=int, default=0, help='seed of the program generator')
+    arg_parser.add_argument("--keywords", default='keywords.txt', help='path to the keyword list')
+    arg_parser.add_argument("--output", default='benchmark.json', help='path of the JSON results')
+    arg_parser.add_argument("--compare", default=None, help='JSON results of an earlier run to compare against')
+    arg_parser.add_argument("--threshold", type=float, default=0.1,
+                            help='slowdown ratio above which --compare reports a regression')
+    arg_parser.add_argument("--emit", default=None,
+                            help='only write the generated programs to this directory, as <shape>.simple')
+    opt = arg_parser.parse_args()
+
+    with open(opt.keywords) as fk:
+        keywords = ''.join(fk.readlines()).split()
+
+    programs = {shape: ProgramGenerator(seed=opt.seed, **SHAPES[shape](opt.size)).program() for shape in opt.shapes}
+    if opt.emit:
+        os.makedirs(opt.emit, exist_ok=True)
+        for shape, text in programs.items():
+            with open(os.path.join(opt.emit, shape + '.simple'), 'w') as fo:
+                fo.write(text)
+        sys.exit()
+
+    results = {'python': platform.python_version(), 'platform': platform.platform(), 'time': time.time(),
+               'size': opt.size, 'seed': opt.seed, 'repeat': opt.repeat, 'shapes': {}}
+    for shape, text in programs.items():
+        results['shapes'][shape] = bench(text, keywords, opt.repeat)
+    report(results)
+    with open(opt.output, 'w') as fo:
+        json.dump(results, fo, indent=2)
+    print('results written to %s' % opt.output)
+
+    if opt.compare:
+        with open(opt.compare) as fi:
+            regressions = compare(results, json.load(fi), opt.threshold)
+        if regressions:
+            sys.exit('%d stages slower than %s' % (len(regressions), opt.compare))
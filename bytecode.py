@@ -0,0 +1,411 @@
+import codecs
+from array import array
+from symbol_table import SymbolTable
+
+# opcodes, each followed by the number of int operands listed in OPERANDS
+LOAD_CONST, LOAD_GLOBAL, STORE_GLOBAL, LOAD_LOCAL, STORE_LOCAL, LOAD_OUTER, STORE_OUTER = range(7)
+# an array takes one slot per element, the element ops read the element offset from the stack
+# and take the array's first slot and its size as operands, after the depth for the OUTER ones
+LOAD_ELEM_GLOBAL, STORE_ELEM_GLOBAL, LOAD_ELEM_LOCAL, STORE_ELEM_LOCAL, LOAD_ELEM_OUTER, STORE_ELEM_OUTER = range(7, 13)
+# DIV is floor division when both operands are integers, as in Python (-7 / 2 is -4), and true division
+# otherwise; the VM and the constant folding in optimizer.py both follow this definition
+ADD, SUB, MUL, DIV, NEG = range(13, 18)
+LT, LE, GT, GE, EQ, NE, AND, OR, NOT = range(18, 27)
+JUMP, JUMP_IF_FALSE, CALL, RETURN, READ, WRITE, HALT = range(27, 34)
+
+OPNAMES = ['LOAD_CONST', 'LOAD_GLOBAL', 'STORE_GLOBAL', 'LOAD_LOCAL', 'STORE_LOCAL', 'LOAD_OUTER', 'STORE_OUTER',
+           'LOAD_ELEM_GLOBAL', 'STORE_ELEM_GLOBAL', 'LOAD_ELEM_LOCAL', 'STORE_ELEM_LOCAL',
+           'LOAD_ELEM_OUTER', 'STORE_ELEM_OUTER', 'ADD', 'SUB', 'MUL', 'DIV', 'NEG',
+           'LT', 'LE', 'GT', 'GE', 'EQ', 'NE', 'AND', 'OR', 'NOT',
+           'JUMP', 'JUMP_IF_FALSE', 'CALL', 'RETURN', 'READ', 'WRITE', 'HALT']
+OPERANDS = {LOAD_CONST: 1, LOAD_GLOBAL: 1, STORE_GLOBAL: 1, LOAD_LOCAL: 1, STORE_LOCAL: 1,
+            LOAD_OUTER: 2, STORE_OUTER: 2, LOAD_ELEM_GLOBAL: 2, STORE_ELEM_GLOBAL: 2, LOAD_ELEM_LOCAL: 2,
+            STORE_ELEM_LOCAL: 2, LOAD_ELEM_OUTER: 3, STORE_ELEM_OUTER: 3, JUMP: 1, JUMP_IF_FALSE: 1, CALL: 2, READ: 1}
+
+ARITHMETIC = {'+': ADD, '-': SUB, '*': MUL, '/': DIV}
+RELATIONS = {'<': LT, '<=': LE, '>': GT, '>=': GE, '=': EQ, '<>': NE}
+
+# simple types, also the operand of READ
+TYPES = ['integer', 'real', 'bool', 'char']
+DEFAULTS = [0, 0.0, False, '']
+
+
+class CompileError(Exception):
+    pass
+
+
+class Procedure:
+    # one entry of the procedure table; level is the nesting depth of its body, the program body being 0
+    def __init__(self, name, level):
+        self.name = name
+        self.level = level
+        self.entry = None
+        self.n_params = 0
+        self.template = []  # initial values of the locals, parameters first
+
+
+class Program:
+    # compiled form: code words, constant pool, procedure table, and the initial globals
+    def __init__(self):
+        self.code = array('i')
+        self.constants = []
+        self.constant_ids = {}
+        self.procedures = []
+        self.globals = []
+
+    def constant(self, value):
+        key = (value.__class__, value)  # keeps 1, 1.0 and True apart
+        index = self.constant_ids.get(key)
+        if index is None:
+            index = self.constant_ids[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def disassemble(self):
+        lines, code, pc = [], self.code, 0
+        entries = {procedure.entry: procedure.name for procedure in self.procedures}
+        while pc < len(code):
+            op = code[pc]
+            operands = list(code[pc + 1:pc + 1 + OPERANDS.get(op, 0)])
+            note = ''
+            if op == LOAD_CONST:
+                note = repr(self.constants[operands[0]])
+            elif op == CALL:
+                note = self.procedures[operands[0]].name
+            if pc in entries:
+                lines.append('%s:' % entries[pc])
+            lines.append('%6d %-17s %-10s %s' % (pc, OPNAMES[op], ' '.join(map(str, operands)), note))
+            pc += 1 + len(operands)
+        return '\n'.join(lines)
+
+
+class Compiler:
+    # lowers the Node tree produced by simple_analyzer into a Program
+    # names are resolved through the SymbolTable of the parse, whose resolved map leads every identifier
+    # to its Symbol, and the locals of a frame are laid out as the table's slots, a scope's variables and
+    # parameters being followed by the hidden locals of its for loops; the compiler only adds what the table
+    # does not keep: the value of each constant and the Procedure of each procedure
+    def __init__(self):
+        self.program = Program()
+        self.code = self.program.code
+        self.symbols = None
+        self.scopes = None
+        self.values = {}  # constant Symbol -> value
+        self.procedures = {}  # procedure Symbol -> Procedure
+        self.templates = {}  # scope index -> initial values of its locals
+
+    def compile(self, root, symbols=None):
+        # symbols is the SymbolTable built along with root, rebuilt from the tree if not given
+        if root is None or root.type != 'program':
+            raise CompileError('expected a program node')
+        self.symbols = symbols if symbols is not None else SymbolTable.from_tree(root)
+        self.scopes = iter(self.symbols.scopes)  # in the order the procedures are declared, as they were opened
+        scope = self.open_scope()
+        self.subroutine(root.children[1], scope, None)
+        self.emit(HALT)
+        self.program.globals = self.templates[scope.index]
+        return self.program
+
+    def emit(self, op, *operands):
+        self.code.append(op)
+        self.code.extend(operands)
+        return len(self.code) - 1  # position of the last operand, for patching jumps
+
+    def here(self):
+        return len(self.code)
+
+    # names
+
+    def open_scope(self):
+        scope = next(self.scopes)
+        template = self.templates[scope.index] = [None] * scope.size
+        for symbol in scope.symbols:
+            if symbol.slot is not None:
+                template[symbol.slot:symbol.slot + symbol.size] = [DEFAULTS[TYPES.index(symbol.type)]] * symbol.size
+        return scope
+
+    def declared(self, identifier, scope):
+        # the Symbol declared by an identifier
+        if identifier in self.symbols.errors:
+            raise CompileError(self.symbols.errors[identifier])
+        return scope.names[identifier.leaf]
+
+    def lookup(self, identifier):
+        # the Symbol an identifier refers to
+        symbol = self.symbols.resolved.get(identifier)
+        if symbol is None:
+            raise CompileError(self.symbols.errors.get(identifier, 'undeclared identifier %s' % identifier.leaf))
+        return symbol
+
+    def level(self, symbol):
+        return self.symbols.scopes[symbol.scope].level
+
+    # declarations
+
+    def subroutine(self, node, scope, procedure):
+        constant_declaration, variable_declaration, procedure_declaration, compound_clause = node.children
+        for child in constant_declaration.children:
+            if child is not None:
+                self.constant_definition(child, scope)
+        for child in variable_declaration.children:
+            self.variable_definition(child, scope)
+        if procedure_declaration.children[0] is not None:
+            skip = self.emit(JUMP, 0)
+            self.procedure(procedure_declaration, scope)
+            self.code[skip] = self.here()
+        if procedure is not None:
+            procedure.entry = self.here()
+            procedure.template = self.templates[scope.index]
+        self.statement(compound_clause, scope)
+
+    def constant_definition(self, node, scope):
+        children = node.children
+        for i in range(0, len(children), 2):
+            value = self.constant_value(children[i + 1].children[0])
+            self.values[self.declared(children[i], scope)] = value
+
+    def constant_value(self, node):
+        if node.type == 'integer':
+            return node.leaf
+        if node.type == 'boolean_constant':
+            return node.leaf.lower() == 'true'
+        if node.type == 'character_constant':
+            return self.string(node.leaf)
+        if node.type == 'real_number':
+            return float('%d.%d' % (node.children[0].leaf, node.children[1].leaf))
+        symbol = self.lookup(node.children[0])  # constant_identifier
+        if symbol.kind != 'constant':
+            raise CompileError('%s is not a constant' % symbol.name)
+        return self.values[symbol]
+
+    @staticmethod
+    def string(literal):
+        return codecs.decode(literal[1:-1], 'unicode_escape')
+
+    def variable_definition(self, node, scope):
+        children = node.children
+        for i in range(0, len(children), 2):
+            for identifier in children[i].children:
+                self.declared(identifier, scope)
+
+    def allocate(self, scope):
+        # a new hidden integer local of scope, after its variables, returns its slot
+        template = self.templates[scope.index]
+        template.append(DEFAULTS[0])
+        return len(template) - 1
+
+    def procedure(self, node, scope):
+        identifier, parameters, subroutine = node.children
+        symbol = self.declared(identifier, scope)
+        inner = self.open_scope()
+        procedure = self.procedures[symbol] = Procedure(symbol.name, inner.level)
+        self.program.procedures.append(procedure)
+        children = parameters.children
+        for i in range(0, len(children), 2):
+            variable = children[i].children[0]
+            if variable.type != 'single_variable':
+                raise CompileError('array parameters are not supported')
+            self.declared(variable.children[0], inner)
+        procedure.n_params = len(children) // 2
+        self.subroutine(subroutine, inner, procedure)
+        self.emit(RETURN)
+
+    # statements
+
+    def statement(self, node, scope):
+        # descends through the single-child wrappers to the clause itself
+        while node.type in ('execution_clause', 'simple_clause', 'structured_clause'):
+            node = node.children[0]
+        getattr(self, node.type)(node, scope)
+
+    def compound_clause(self, node, scope):
+        for child in node.children[0].children:
+            self.statement(child, scope)
+
+    def assignment(self, node, scope):
+        variable, expression = node.children
+        self.store(variable, scope, lambda: self.expression(expression, scope))
+
+    def store(self, node, scope, value):
+        symbol, target = self.resolve(node)
+        if target is None:
+            value()
+            self.emit_access(symbol, scope, STORE_GLOBAL, STORE_LOCAL, STORE_OUTER)
+        else:
+            self.element_offset(symbol, target, scope)
+            value()
+            self.emit_slot(self.level(symbol), scope, STORE_ELEM_GLOBAL, STORE_ELEM_LOCAL, STORE_ELEM_OUTER,
+                           symbol.slot, symbol.size)
+
+    def load(self, node, scope):
+        symbol, target = self.resolve(node)
+        if target is None:
+            self.emit_access(symbol, scope, LOAD_GLOBAL, LOAD_LOCAL, LOAD_OUTER)
+        else:
+            self.element_offset(symbol, target, scope)
+            self.emit_slot(self.level(symbol), scope, LOAD_ELEM_GLOBAL, LOAD_ELEM_LOCAL, LOAD_ELEM_OUTER,
+                           symbol.slot, symbol.size)
+
+    def resolve(self, node):
+        # variable -> (Symbol, expression_table of the subscripts or None)
+        node = node.children[0]
+        symbol = self.lookup(node.children[0])
+        if symbol.slot is None:
+            raise CompileError('%s is not a variable' % symbol.name)
+        if node.type == 'single_variable':
+            if symbol.dims is not None:
+                raise CompileError('%s is an array' % symbol.name)
+            return symbol, None
+        if symbol.dims is None:
+            raise CompileError('%s is not an array' % symbol.name)
+        return symbol, node.children[1]
+
+    def emit_access(self, symbol, scope, op_global, op_local, op_outer):
+        self.emit_slot(self.level(symbol), scope, op_global, op_local, op_outer, symbol.slot)
+
+    def emit_slot(self, level, scope, op_global, op_local, op_outer, *operands):
+        # the op for a slot of the frame at a nesting level, as seen from the code of scope
+        if level == 0:
+            self.emit(op_global, *operands)
+        elif level == scope.level:
+            self.emit(op_local, *operands)
+        else:
+            self.emit(op_outer, scope.level - level, *operands)
+
+    def element_offset(self, symbol, subscripts, scope):
+        # row-major offset: ((s1 - low1) * size2 + (s2 - low2)) * size3 ...
+        subscripts, dims = subscripts.children, symbol.dims
+        if len(subscripts) != len(dims):
+            raise CompileError('expected %d subscripts' % len(dims))
+        for i, (expression, (low, size)) in enumerate(zip(subscripts, dims)):
+            self.expression(expression, scope)
+            if low:
+                self.emit(LOAD_CONST, self.program.constant(low))
+                self.emit(SUB)
+            if i:
+                self.emit(ADD)
+            if i + 1 < len(dims):
+                self.emit(LOAD_CONST, self.program.constant(dims[i + 1][1]))
+                self.emit(MUL)
+
+    def calling(self, node, scope):
+        identifier, parameters = node.children
+        symbol = self.lookup(identifier)
+        if symbol.kind != 'procedure':
+            raise CompileError('%s is not a procedure' % identifier.leaf)
+        procedure = self.procedures[symbol]
+        if len(parameters.children) != procedure.n_params:
+            raise CompileError('%s takes %d parameters' % (procedure.name, procedure.n_params))
+        for expression in parameters.children:
+            self.expression(expression, scope)
+        # the callee's static link is the frame its declaration is nested in
+        self.emit(CALL, self.program.procedures.index(procedure), scope.level - (procedure.level - 1))
+
+    def read_clause(self, node, scope):
+        for variable in node.children[0].children:
+            type = TYPES.index(self.resolve(variable)[0].type)
+            self.store(variable, scope, lambda: self.emit(READ, type))
+
+    def write_clause(self, node, scope):
+        for expression in node.children[0].children:
+            self.expression(expression, scope)
+            self.emit(WRITE)
+
+    def if_clause(self, node, scope):
+        self.expression(node.children[0], scope)
+        skip = self.emit(JUMP_IF_FALSE, 0)
+        self.statement(node.children[1], scope)
+        if len(node.children) == 3:
+            end = self.emit(JUMP, 0)
+            self.code[skip] = self.here()
+            self.statement(node.children[2], scope)
+            self.code[end] = self.here()
+        else:
+            self.code[skip] = self.here()
+
+    def while_clause(self, node, scope):
+        top = self.here()
+        self.expression(node.children[0], scope)
+        exit = self.emit(JUMP_IF_FALSE, 0)
+        self.statement(node.children[1], scope)
+        self.emit(JUMP, top)
+        self.code[exit] = self.here()
+
+    def repeat_clause(self, node, scope):
+        top = self.here()
+        self.statement(node.children[0], scope)
+        self.expression(node.children[1], scope)
+        self.emit(JUMP_IF_FALSE, top)
+
+    def for_clause(self, node, scope):
+        # the limit is evaluated once into a hidden local, the body runs for start..limit inclusive
+        variable, start, limit, body = node.children
+        hidden = self.allocate(scope)
+        self.expression(limit, scope)
+        self.emit_slot(scope.level, scope, STORE_GLOBAL, STORE_LOCAL, STORE_OUTER, hidden)
+        self.store(variable, scope, lambda: self.expression(start, scope))
+        top = self.here()
+        self.load(variable, scope)
+        self.emit_slot(scope.level, scope, LOAD_GLOBAL, LOAD_LOCAL, LOAD_OUTER, hidden)
+        self.emit(LE)
+        exit = self.emit(JUMP_IF_FALSE, 0)
+        self.statement(body, scope)
+        self.store(variable, scope, lambda: self.increment(variable, scope))
+        self.emit(JUMP, top)
+        self.code[exit] = self.here()
+
+    def increment(self, variable, scope):
+        self.load(variable, scope)
+        self.emit(LOAD_CONST, self.program.constant(1))
+        self.emit(ADD)
+
+    # expressions
+
+    def expression(self, node, scope):
+        # dispatches on the node type alone, so trees with collapsed wrapper chains compile as well
+        # with an explicit stack instead of recursion, as the left-recursive grammar nests a node per operator:
+        # an item is a Node still to compile, or an opcode to emit once the operands pushed above it are done
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.__class__ is int:
+                self.emit(node)
+                continue
+            type, children = node.type, node.children
+            if type in ('arithmetic_expression', 'term') and len(children) == 2:
+                stack += [ARITHMETIC[node.leaf], children[1], children[0]]
+            elif type == 'arithmetic_expression' and node.leaf == '-':
+                stack += [NEG, children[0]]
+            elif type in ('boolean_expression', 'boolean_term') and len(children) == 2:
+                stack += [OR if type == 'boolean_expression' else AND, children[1], children[0]]
+            elif type == 'boolean_factor' and node.leaf is not None:
+                stack += [NOT, children[0]]
+            elif type == 'boolean_value' and len(children) == 3:
+                # ( arithmetic_expression ) relation_symbol ( arithmetic_expression )
+                stack += [RELATIONS[children[1].leaf], children[2], children[0]]
+            elif type == 'boolean_value' and len(children) == 4:
+                raise CompileError("'( boolean_expression ) identifier relation identifier' has no defined meaning")
+            elif type == 'integer':
+                self.emit(LOAD_CONST, self.program.constant(node.leaf))
+            elif type == 'boolean_constant':
+                self.emit(LOAD_CONST, self.program.constant(node.leaf.lower() == 'true'))
+            elif type == 'character_constant':
+                self.emit(LOAD_CONST, self.program.constant(self.string(node.leaf)))
+            elif type == 'identifier':
+                self.value(node, scope)
+            else:
+                # single-child wrappers: expression, factor, arithmetic_value, character_value, ...
+                stack.append(children[0])
+
+    def value(self, node, scope):
+        symbol = self.lookup(node)
+        if symbol.kind == 'constant':
+            self.emit(LOAD_CONST, self.program.constant(self.values[symbol]))
+        elif symbol.slot is not None and symbol.dims is None:
+            self.emit_access(symbol, scope, LOAD_GLOBAL, LOAD_LOCAL, LOAD_OUTER)
+        else:
+            raise CompileError('%s is not a value' % node.leaf)
+
+
+def compile_program(root, symbols=None):
+    return Compiler().compile(root, symbols)
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import struct
+import tempfile
+
+# bumped whenever the layout of the cached values changes
+VERSION = 3
+
+
+def fingerprint(*parts):
+    # hash of everything a cached result depends on besides the source itself,
+    # such as the grammar signature, the automaton tables and the keyword list
+    digest = hashlib.sha1(b'%d' % VERSION)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def encode_json(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def decode_json(data):
+    return json.loads(data.decode('utf-8'))
+
+
+def token_cache(directory, automaton, keywords, max_bytes=64 << 20):
+    # an AnalysisCache for the (lexeme, accepted_state) pairs of an Automaton, keyed to its tables and the keywords
+    return AnalysisCache(directory, fingerprint('tokens', automaton.signature(), ' '.join(keywords)), max_bytes)
+
+
+class AnalysisCache:
+    # on-disk cache of analysis results, one file per entry, named by the hash of the fingerprint and the source
+    # values are stored as the bytes of encode(value) and read back with decode(data), JSON by default;
+    # nothing is unpickled, since the directory may be shared and loading an entry must not run code
+    # a changed grammar or keyword list changes the fingerprint, so stale entries are simply never hit again
+    # and age out: once the directory grows past max_bytes the least recently used entries are deleted,
+    # a hit touches its file so that modification times order the entries by use
+    # entries are written to a temporary file and renamed, so concurrent processes can share a directory
+    SUFFIX = '.entry'
+
+    def __init__(self, directory, fingerprint, max_bytes=64 << 20, encode=encode_json, decode=decode_json):
+        self.directory = directory
+        self.fingerprint = fingerprint.encode('ascii')
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.decode = decode
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, source):
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+        return os.path.join(self.directory, hashlib.sha1(self.fingerprint + source).hexdigest() + self.SUFFIX)
+
+    def get(self, source):
+        # returns the value stored for source, or None on a miss; an entry that does not decode is a miss
+        path = self.path(source)
+        try:
+            with open(path, 'rb') as f:
+                value = self.decode(f.read())
+            os.utime(path)
+        except (OSError, ValueError, TypeError, KeyError, IndexError, struct.error):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, source, value):
+        # returns False, caching nothing, if the value cannot be encoded
+        try:
+            data = self.encode(value)
+        except (ValueError, TypeError, RecursionError):
+            return False
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path(source))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.evict()
+        return True
+
+    def entries(self):
+        # (mtime, size, path) of every entry, least recently used first
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # evicted by another process
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+if __name__ == "__main__":
+    cache = AnalysisCache(tempfile.mkdtemp(), fingerprint('demo'), max_bytes=1 << 10)
+    print(cache.get('x := 1'))
+    cache.put('x := 1', ['tokens', 'ast'])
+    print(cache.get('x := 1'), cache.hits, cache.misses)
+    for i in range(100):
+        cache.put('x := %d' % i, 'a value of some length ' * 4)
+    print(len(cache.entries()), sum(size for mtime, size, path in cache.entries()))
@@ -0,0 +1,315 @@
+import argparse
+import bisect
+import os
+import time
+from itertools import islice
+from simple_analyzer import SimpleCompiler, build
+
+# the top-level subtrees that can be re-parsed on their own, by their index in subroutine.children
+REGIONS = {'procedure_declaration': 2, 'compound_clause': 3}
+# and the statements of the program's compound_clause, the children of its clause_table,
+# re-parsed one by one or as a run
+STATEMENT = 'execution_clause'
+STATEMENTS = 'clause_table'
+
+
+class IncrementalParser:
+    # keeps the lines, tokens, AST and SymbolTable of one source and updates them on every edit:
+    # only the edited lines are re-lexed, and an edit inside the program's compound_clause re-parses just
+    # the statements on the edited lines, up to the nearest ';' on lines left alone (usually the statement
+    # itself and the next one); an edit that stays inside the top-level procedure_declaration
+    # or the compound_clause as a whole re-parses that subtree, anything else re-parses the file
+    # tokens never span lines (comments and strings cannot hold a newline), so they are kept per line;
+    # a token's lexpos is its column and its lineno is set as it is fed to the parser
+    def __init__(self, text='', compiler=None):
+        self.compiler = compiler or SimpleCompiler()
+        self.parsers = {start: build(start=start)[1] for start in list(REGIONS) + [STATEMENT, STATEMENTS]}
+        self.lines = []
+        self.line_tokens = []
+        self.root = None
+        self.symbols = None
+        # (line, index) of the first token of the top-level procedure and of the program's compound_clause
+        self.procedure_at = self.body_at = None
+        # (line, index) of the BEGIN of the program's compound_clause, of every ';' between its statements
+        # and of its END: statement i is made of the tokens strictly between separators[i] and separators[i + 1]
+        self.separators = []
+        self.last_parse = None  # what the last edit re-parsed: 'program', a key of REGIONS, STATEMENT or STATEMENTS
+        self.update(text)
+
+    @property
+    def text(self):
+        return ''.join(self.lines)
+
+    def update(self, text):
+        # replaces the whole source, e.g. after the file changed on disk, and re-lexes the changed lines only
+        lines = text.splitlines(keepends=True)
+        old = self.lines
+        first, n = 0, min(len(old), len(lines))
+        while first < n and old[first] == lines[first]:
+            first += 1
+        last = 0
+        while last < n - first and old[-1 - last] == lines[-1 - last]:
+            last += 1
+        return self.edit(first, len(old) - last, lines[first:len(lines) - last])
+
+    def edit(self, first, last, lines):
+        # replaces the old lines [first, last) with a list of lines (each ending in a newline except
+        # possibly the last one of the file), returns the root Node or None on a syntax error
+        if first == last and not lines:
+            self.last_parse = None
+            return self.root
+        delta = len(lines) - (last - first)
+        statements = self.statements(first, last)
+        self.lines[first:last] = lines
+        self.line_tokens[first:last] = self.lex(lines, first)
+        if statements is not None and self.parse_statements(*statements, delta):
+            return self.root
+        region = self.region(first, last)
+        if region is not None and self.parse_region(region, delta):
+            self.last_parse = region
+        else:
+            self.parse_program()
+            self.last_parse = 'program'
+        return self.root
+
+    def lex(self, lines, first):
+        lexer = self.compiler.lexer
+        lexer.lineno = 0
+        lexer.input(''.join(lines))
+        line_tokens = [[] for line in lines]
+        starts, offset = [], 0
+        for line in lines:
+            starts.append(offset)
+            offset += len(line)
+        for tok in lexer:
+            tok.lexpos -= starts[tok.lineno]
+            line_tokens[tok.lineno].append(tok)
+        return line_tokens
+
+    def statements(self, first, last):
+        # the statements [i, j) of the program's compound_clause that hold the edited lines [first, last):
+        # separators[i] is the last one before the edited lines and separators[j] the first one after them
+        separators = self.separators
+        if self.root is None or not separators or first <= separators[0][0]:
+            return None
+        j = bisect.bisect_left(separators, (last, 0))
+        if j == len(separators):
+            return None
+        return bisect.bisect_left(separators, (first, 0)) - 1, j
+
+    def region(self, first, last):
+        # the region that the edited lines [first, last) lie strictly inside of, if any;
+        # the lines holding the first token of a region count as its boundary
+        if self.root is None:
+            return None
+        if self.body_at is not None and first > self.body_at[0]:
+            return 'compound_clause'
+        if self.procedure_at is not None and first > self.procedure_at[0] and last <= self.body_at[0]:
+            return 'procedure_declaration'
+        return None
+
+    def feed(self, start, stop=None):
+        # tokenfunc for the parser, yields the tokens from position start up to position stop
+        line_tokens = self.line_tokens
+        line, index = start
+        stop_line, stop_index = stop or (len(line_tokens), 0)
+
+        def token():
+            nonlocal line, index
+            while line < stop_line or (line == stop_line and index < stop_index):
+                tokens = line_tokens[line]
+                if index < len(tokens):
+                    tok = tokens[index]
+                    tok.lineno = line + 1
+                    index += 1
+                    return tok
+                line, index = line + 1, 0
+            return None
+
+        return token
+
+    def parse_program(self):
+        compiler = self.compiler
+        compiler.reset()
+        self.symbols = compiler.symbols
+        self.root = compiler.parser.parse(lexer=compiler.lexer, tokenfunc=self.feed((0, 0)))
+        self.find_regions()
+        self.find_statements()
+
+    def find_regions(self):
+        # the top-level procedure starts at the first PROCEDURE token, since the constant and variable
+        # declarations before it cannot contain one, and the program's compound_clause at the BEGIN
+        # matching the last END
+        self.procedure_at = self.body_at = None
+        if self.root is None:
+            return
+        line_tokens, depth = self.line_tokens, 0
+        for line in range(len(line_tokens) - 1, -1, -1):
+            tokens = line_tokens[line]
+            for index in range(len(tokens) - 1, -1, -1):
+                type = tokens[index].type
+                depth += type == 'END'
+                depth -= type == 'BEGIN'
+                if depth == 0:
+                    self.body_at = line, index
+                    break
+            if self.body_at is not None:
+                break
+        if self.root.children[1].children[2].children[0] is not None:
+            for line, tokens in enumerate(line_tokens):
+                types = [tok.type for tok in tokens]
+                if 'PROCEDURE' in types:
+                    self.procedure_at = line, types.index('PROCEDURE')
+                    break
+
+    def find_statements(self):
+        # the separators of the statements, from the BEGIN of the program's compound_clause to its END
+        self.separators = []
+        if self.root is None:
+            return
+        line, index = self.body_at
+        end = self.find_separators((line, index + 1), None, end=True)
+        self.separators = [self.body_at] + end
+
+    def find_separators(self, start, stop, end=False):
+        # the positions of the ';' outside any BEGIN ... END from position start up to position stop,
+        # with end, the scan stops at the first unmatched END, whose position is added last
+        line_tokens, depth, found = self.line_tokens, 0, []
+        line, index = start
+        stop_line, stop_index = stop or (len(line_tokens), 0)
+        while line < stop_line or (line == stop_line and index < stop_index):
+            tokens = line_tokens[line]
+            if index >= len(tokens):
+                line, index = line + 1, 0
+                continue
+            type = tokens[index].type
+            if type == 'BEGIN':
+                depth += 1
+            elif type == 'END':
+                depth -= 1
+                if depth < 0 and end:
+                    found.append((line, index))
+                    break
+            elif type == ';' and depth == 0:
+                found.append((line, index))
+            index += 1
+        return found
+
+    def parse(self, start, begin, stop):
+        # runs the parser of a start symbol over the tokens from position begin up to position stop,
+        # returns the Node, or None if they do not parse, in which case the entries that the parse added
+        # to the SymbolTable are dropped again
+        symbols = self.symbols
+        n_resolved, n_errors = len(symbols.resolved), len(symbols.errors)
+        errors = []
+        parser = self.parsers[start]
+        parser.errorfunc = errors.append
+        self.compiler.lexer.symbols = symbols
+        node = parser.parse(lexer=self.compiler.lexer, tokenfunc=self.feed(begin, stop))
+        if node is None or errors:
+            for records, n in ((symbols.resolved, n_resolved), (symbols.errors, n_errors)):
+                for key in list(islice(records, n, None)):
+                    del records[key]
+            return None
+        return node
+
+    def parse_statements(self, i, j, delta):
+        # re-parses the tokens that were statements [i, j) of the program's compound_clause, as one
+        # execution_clause or as a clause_table if they now hold several, and splices the result into
+        # its clause_table; returns False if they do not parse on their own
+        # only the uses inside them are resolved again, as a statement declares nothing
+        separators = self.separators
+        line, index = separators[i]
+        stop = separators[j][0] + delta, separators[j][1]
+        inner = self.find_separators((line, index + 1), stop)
+        start = STATEMENT if not inner else STATEMENTS
+        node = self.parse(start, (line, index + 1), stop)
+        if node is None:
+            return False
+        clause_table = self.root.children[1].children[3].children[0]
+        for old in clause_table.children[i:j]:
+            self.symbols.forget(old)
+        clause_table.children[i:j] = [node] if start == STATEMENT else node.children
+        clause_table.leaf = ';' if len(clause_table.children) > 1 else None
+        if delta:
+            separators[j:] = [(line + delta, index) for line, index in separators[j:]]
+        separators[i + 1:j] = inner
+        self.last_parse = start
+        return True
+
+    def parse_region(self, region, delta):
+        # re-parses one top-level subtree in place, returns False if it no longer parses on its own
+        subroutine = self.root.children[1]
+        index = REGIONS[region]
+        old = subroutine.children[index]
+        symbols = self.symbols
+        if region == 'procedure_declaration':
+            heading = old.children[0]
+            declared = heading not in symbols.errors
+            symbols.rewind(len(symbols.scopes[0].symbols) - declared, 1)
+            start, stop = self.procedure_at, (self.body_at[0] + delta, self.body_at[1])
+        else:
+            start, stop = self.body_at, None
+        symbols.forget(old)
+        node = self.parse(region, start, stop)
+        if node is None:
+            return False
+        subroutine.children[index] = node
+        if region == 'compound_clause':
+            self.find_statements()
+        else:
+            self.body_at = stop
+            self.separators = [(line + delta, index) for line, index in self.separators]
+            heading_now = node.children[0]
+            if heading_now.leaf != heading.leaf or (heading_now not in symbols.errors) != declared:
+                self.resolve_body()
+        return True
+
+    def resolve_body(self):
+        # the procedure's name changed, so the uses in the program's compound_clause are resolved again
+        symbols = self.symbols
+        for node, depth in self.root.children[1].children[3].preorder():
+            if node.type == 'identifier':
+                symbols.resolved.pop(node, None)
+                symbols.errors.pop(node, None)
+                symbols.resolve(node)
+
+
+def watch(path, interval, verbose):
+    # re-parses the file whenever it changes on disk, until interrupted
+    incremental, mtime = None, None
+    while True:
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except OSError:
+            modified = None
+        if modified is not None and modified != mtime:
+            mtime = modified
+            with open(path) as f:
+                text = f.read()
+            start = time.perf_counter()
+            if incremental is None:
+                incremental = IncrementalParser(text)
+            else:
+                incremental.update(text)
+            elapsed = (time.perf_counter() - start) * 1000
+            status = 'ok' if incremental.root is not None else 'syntax error'
+            print('%s: %s, re-parsed %s in %.2f ms' % (path, status, incremental.last_parse, elapsed))
+            if incremental.root is not None:
+                for error in incremental.symbols.errors.values(): print('    ', error)
+                if verbose:
+                    incremental.root.traverse()
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--input", required=True, help='path to the source file to watch')
+    arg_parser.add_argument("--interval", type=float, default=0.1, help='seconds between checks of the file')
+    arg_parser.add_argument("--verbose", action='store_true', help='print the AST after every change')
+    opt = arg_parser.parse_args()
+
+    try:
+        watch(opt.input, opt.interval, opt.verbose)
+    except KeyboardInterrupt:
+        pass
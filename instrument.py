@@ -0,0 +1,240 @@
+import sys
+import time
+from collections import Counter
+
+# cProfile, pstats, tracemalloc and json are imported by the methods that use them,
+# so that importing the profiler while it stays disabled costs only the timers and counters
+
+
+class NullPhase:
+    # what Profiler.phase() returns while profiling is off, entering it does nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.start(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.stop()
+
+
+class PhaseStats:
+    __slots__ = ('calls', 'total', 'self', 'peak')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0  # seconds, including nested phases
+        self.self = 0.0  # seconds, excluding nested phases
+        self.peak = 0  # bytes, highest traced memory seen inside the phase, with memory tracing only
+
+
+class Profiler:
+    # named phase timers and counters for the lexer and compiler pipeline
+    # disabled, phase() hands out a shared no-op context manager and the per-token and per-reduction hooks
+    # (timed(), wrap(), instrument_parser()) are not installed at all: callers check `enabled` first,
+    # so the instrumentation can stay in place in production
+    # phases nest: `total` includes the time of the phases opened inside one, `self` does not
+    def __init__(self):
+        self.enabled = False
+        self.stack = []  # [name, start, time spent in nested phases, peak memory]
+        self.phases = {}
+        self.totals = Counter()
+        self.groups = {}
+        self.cprofile = None
+        self.memory = False
+        self.tracemalloc = None  # the module, once memory tracing is on
+
+    def enable(self, cprofile=False, memory=False):
+        self.enabled = True
+        self.memory = memory
+        if memory:
+            import tracemalloc
+            self.tracemalloc = tracemalloc
+            tracemalloc.start()
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def disable(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.memory:
+            self.tracemalloc.stop()
+        self.enabled = False
+
+    def phase(self, name):
+        return Phase(self, name) if self.enabled else NULL_PHASE
+
+    def start(self, name):
+        peak = 0
+        if self.memory:
+            if self.stack:
+                frame = self.stack[-1]
+                frame[3] = max(frame[3], self.tracemalloc.get_traced_memory()[1])
+            self.tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), 0.0, peak])
+
+    def stop(self):
+        name, start, nested, peak = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats()
+        stats.calls += 1
+        stats.total += elapsed
+        stats.self += elapsed - nested
+        if self.memory:
+            peak = max(peak, self.tracemalloc.get_traced_memory()[1])
+            stats.peak = max(stats.peak, peak)
+        if self.stack:
+            frame = self.stack[-1]
+            frame[2] += elapsed
+            frame[3] = max(frame[3], peak)
+
+    def timed(self, iterable, name):
+        # yields the items of iterable, timing the production of each one as the phase name
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    def wrap(self, function, name):
+        # function, timed as the phase name on every call
+        def timed(*args, **kwargs):
+            self.start(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.stop()
+
+        return timed
+
+    def instrument(self, obj, method, name):
+        # times every call of obj.method as the phase name, for this one object
+        setattr(obj, method, self.wrap(getattr(obj, method), name))
+
+    def instrument_parser(self, parser):
+        # counts the reductions of a PLY parser per production and times its grammar actions as 'actions'
+        reductions = self.group('reductions')
+        for production in parser.productions:
+            action = production.callable
+            if action is not None and not hasattr(action, 'production'):
+                production.callable = self.reduction(action, production.str, reductions)
+
+    def reduction(self, action, label, reductions):
+        timed = self.wrap(action, 'actions')
+
+        def reduce(p):
+            reductions[label] += 1
+            return timed(p)
+
+        reduce.production = label
+        return reduce
+
+    def count(self, name, n=1):
+        self.totals[name] += n
+
+    def group(self, name):
+        counter = self.groups.get(name)
+        if counter is None:
+            counter = self.groups[name] = Counter()
+        return counter
+
+    def tally(self, name, items):
+        # adds an iterable of keys, or a mapping of counts, to the counter group name
+        self.group(name).update(items)
+
+    def report(self, top=15):
+        # the measurements as a dict of plain values, ready for json
+        phases = {name: {'calls': stats.calls, 'total': stats.total, 'self': stats.self}
+                  for name, stats in self.phases.items()}
+        if self.memory:
+            for name, stats in self.phases.items():
+                phases[name]['peak_bytes'] = stats.peak
+        report = {'phases': phases, 'counters': dict(self.totals),
+                  'groups': {name: dict(counter.most_common()) for name, counter in self.groups.items()}}
+        if self.cprofile is not None:
+            import pstats
+            self.cprofile.disable()
+            entries = sorted(pstats.Stats(self.cprofile).stats.items(), key=lambda item: -item[1][2])[:top]
+            report['functions'] = [{'function': '%s:%d(%s)' % key, 'calls': value[1], 'self': value[2],
+                                    'total': value[3]} for key, value in entries]
+        return report
+
+    def summary(self, top=15):
+        report = self.report(top)
+        lines = ['%-24s %8s %12s %12s' % ('phase', 'calls', 'total ms', 'self ms')]
+        for name, entry in sorted(report['phases'].items(), key=lambda item: -item[1]['total']):
+            line = '%-24s %8d %12.2f %12.2f' % (name, entry['calls'], entry['total'] * 1000, entry['self'] * 1000)
+            if 'peak_bytes' in entry:
+                line += '  peak %.1f KB' % (entry['peak_bytes'] / 1024)
+            lines.append(line)
+        for name, value in report['counters'].items():
+            lines.append('%s: %d' % (name, value))
+        for name, counter in report['groups'].items():
+            lines.append('%s:' % name)
+            lines += ['    %8d  %s' % (value, key) for key, value in list(counter.items())[:top]]
+            if len(counter) > top:
+                lines.append('    ... %d more' % (len(counter) - top))
+        if 'functions' in report:
+            lines.append('functions by self time:')
+            lines += ['    %8.2f ms %8d  %s' % (entry['self'] * 1000, entry['calls'], entry['function'])
+                      for entry in report['functions']]
+        return '\n'.join(lines)
+
+    def dump(self, json_path=None, stream=sys.stderr):
+        # prints the summary, and writes the report as json as well when given a path
+        if json_path:
+            import json
+            with open(json_path, 'w') as fo:
+                json.dump(self.report(), fo, indent=2)
+        print(self.summary(), file=stream)
+
+
+# the one profiler of the process, enabled by the --profile options of the entry points
+profiler = Profiler()
+
+
+def add_arguments(arg_parser):
+    # the --profile options shared by the entry points
+    arg_parser.add_argument("--profile", action='store_true',
+                            help='time the phases of the run and print a summary to stderr at the end')
+    arg_parser.add_argument("--profile-json", default=None,
+                            help='also write the profile to this path as JSON (implies --profile)')
+    arg_parser.add_argument("--profile-functions", action='store_true',
+                            help='run cProfile as well and report the functions with the most self time')
+    arg_parser.add_argument("--profile-memory", action='store_true',
+                            help='trace allocations with tracemalloc and report the peak of every phase')
+
+
+def start(opt):
+    # enables the profiler if any of the --profile options is given, returns whether it did
+    if opt.profile or opt.profile_json or opt.profile_functions or opt.profile_memory:
+        profiler.enable(cprofile=opt.profile_functions, memory=opt.profile_memory)
+    return profiler.enabled
+
+
+def finish(opt):
+    if profiler.enabled:
+        profiler.dump(opt.profile_json)
+        profiler.disable()
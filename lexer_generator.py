@@ -0,0 +1,344 @@
+from collections import deque
+
+
+# regular expressions over an alphabet, a subset of the `re` syntax:
+#   ab  a|b  a*  a+  a?  (a)  [abc]  [a-z]  [^a-z]  .  \d \w \s  \n \t \r  \<char>
+# a negated class and . are taken relative to the alphabet, . excluding the newline as in `re`;
+# the alphabet may hold a pseudo-char standing for all the chars outside it, which these two then match as well
+CLASS_ESCAPES = {'d': '0123456789', 'w': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_',
+                 's': ' \t\r\n'}
+CHAR_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r'}
+
+
+class NFA:
+    # Thompson construction, edges[state] is a list of (chars, target), chars None for an epsilon edge
+    # accept[state] is the index of the token a state accepts, for the final state of each pattern
+    def __init__(self, alphabet):
+        self.alphabet = alphabet
+        self.edges = []
+        self.accept = {}
+
+    def state(self):
+        self.edges.append([])
+        return len(self.edges) - 1
+
+    def edge(self, state, chars, target):
+        self.edges[state].append((chars, target))
+
+    def add(self, pattern, token):
+        # adds a pattern accepting as token, returns its start state
+        start, end = RegexParser(pattern, self).parse()
+        self.accept[end] = token
+        return start
+
+    def closure(self, states):
+        stack, seen = list(states), set(states)
+        while stack:
+            for chars, target in self.edges[stack.pop()]:
+                if chars is None and target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return frozenset(seen)
+
+
+class RegexParser:
+    # recursive descent over a pattern, building the NFA fragment (start, end) of every subexpression
+    def __init__(self, pattern, nfa):
+        self.pattern = pattern
+        self.pos = 0
+        self.nfa = nfa
+
+    def error(self, message):
+        return ValueError('%s at %d in pattern %r' % (message, self.pos, self.pattern))
+
+    def peek(self):
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def take(self):
+        ch = self.peek()
+        if ch is None:
+            raise self.error('unexpected end')
+        self.pos += 1
+        return ch
+
+    def parse(self):
+        fragment = self.alternation()
+        if self.peek() is not None:
+            raise self.error('unbalanced )')
+        return fragment
+
+    def alternation(self):
+        branches = [self.concatenation()]
+        while self.peek() == '|':
+            self.pos += 1
+            branches.append(self.concatenation())
+        if len(branches) == 1:
+            return branches[0]
+        nfa = self.nfa
+        start, end = nfa.state(), nfa.state()
+        for first, last in branches:
+            nfa.edge(start, None, first)
+            nfa.edge(last, None, end)
+        return start, end
+
+    def concatenation(self):
+        nfa = self.nfa
+        start = end = nfa.state()
+        while self.peek() not in (None, '|', ')'):
+            first, last = self.repetition()
+            nfa.edge(end, None, first)
+            end = last
+        return start, end
+
+    def repetition(self):
+        first, last = self.atom()
+        nfa = self.nfa
+        while self.peek() in ('*', '+', '?'):
+            operator = self.take()
+            start, end = nfa.state(), nfa.state()
+            nfa.edge(start, None, first)
+            nfa.edge(last, None, end)
+            if operator != '+':
+                nfa.edge(start, None, end)
+            if operator != '?':
+                nfa.edge(last, None, first)
+            first, last = start, end
+        return first, last
+
+    def atom(self):
+        ch = self.take()
+        if ch == '(':
+            fragment = self.alternation()
+            if self.take() != ')':
+                raise self.error('expected )')
+            return fragment
+        if ch in ('*', '+', '?', ')', '|'):
+            raise self.error('unexpected %s' % ch)
+        if ch == '[':
+            chars = self.char_class()
+        elif ch == '.':
+            chars = self.nfa.alphabet - {'\n'}
+        elif ch == '\\':
+            chars = set(self.escape())
+        else:
+            chars = {ch}
+        missing = chars - self.nfa.alphabet
+        if missing:
+            raise self.error('%r outside the alphabet' % ''.join(sorted(missing)))
+        start, end = self.nfa.state(), self.nfa.state()
+        self.nfa.edge(start, frozenset(chars), end)
+        return start, end
+
+    def escape(self):
+        ch = self.take()
+        return CLASS_ESCAPES.get(ch) or CHAR_ESCAPES.get(ch) or ch
+
+    def char_class(self):
+        negated = self.peek() == '^'
+        if negated:
+            self.pos += 1
+        chars, first = set(), True
+        while first or self.peek() != ']':
+            first = False
+            ch = self.take()
+            if ch == '\\':
+                low = self.escape()
+                if len(low) > 1:
+                    chars.update(low)
+                    continue
+            else:
+                low = ch
+            if self.peek() == '-' and self.pattern[self.pos + 1:self.pos + 2] not in ('', ']'):
+                self.pos += 1
+                high = self.take()
+                if high == '\\':
+                    high = self.escape()
+                if len(high) > 1 or high < low:
+                    raise self.error('bad range %s-%s' % (low, high))
+                chars.update(chr(code) for code in range(ord(low), ord(high) + 1))
+            else:
+                chars.add(low)
+        self.pos += 1
+        return self.nfa.alphabet - chars if negated else chars
+
+
+def escape(text):
+    # a pattern matching text literally
+    return ''.join(ch if ch.isalnum() or ch == '_' else '\\' + ch for ch in text)
+
+
+def chars_of(pattern, alphabet):
+    # the chars of a pattern that matches single chars, such as [a-z_]
+    nfa = NFA(alphabet)
+    nfa.add(pattern, 0)
+    chars = set()
+    for edges in nfa.edges:
+        for edge_chars, target in edges:
+            if edge_chars is not None:
+                chars |= edge_chars
+    return chars
+
+
+def subset_construction(nfa, starts, alphabet):
+    # the DFA of the union of the patterns: delta[state] maps a char to a state, missing entries are dead,
+    # labels[state] is the token it accepts, the first one in the specification when several patterns end there
+    start = nfa.closure(starts)
+    index, sets = {start: 0}, [start]
+    delta, labels = [], []
+    i = 0
+    while i < len(sets):
+        current = sets[i]
+        tokens = [nfa.accept[state] for state in current if state in nfa.accept]
+        labels.append(min(tokens) if tokens else None)
+        moves = {}
+        for state in current:
+            for chars, target in nfa.edges[state]:
+                if chars is not None:
+                    for ch in chars:
+                        moves.setdefault(ch, set()).add(target)
+        row = {}
+        for ch in alphabet:
+            if ch in moves:
+                target = nfa.closure(moves[ch])
+                if target not in index:
+                    index[target] = len(sets)
+                    sets.append(target)
+                row[ch] = index[target]
+        delta.append(row)
+        i += 1
+    return delta, labels
+
+
+def minimize(delta, labels, alphabet):
+    # Hopcroft's partition refinement, starting from the states grouped by the token they accept;
+    # returns the delta and labels of the minimal DFA, whose state 0 is the start state
+    n = len(delta)
+    dead = n  # the implicit dead state, making the transition function total
+    inverse = {ch: {} for ch in alphabet}
+    for state in range(n):
+        row = delta[state]
+        for ch in alphabet:
+            inverse[ch].setdefault(row.get(ch, dead), set()).add(state)
+    for ch in alphabet:
+        inverse[ch].setdefault(dead, set()).add(dead)
+
+    groups = {}
+    for state in range(n):
+        groups.setdefault(labels[state], set()).add(state)
+    groups.setdefault(None, set()).add(dead)
+    partition = [frozenset(group) for group in groups.values()]
+    waiting = list(partition)
+    while waiting:
+        splitter = waiting.pop()
+        for ch in alphabet:
+            predecessors = set()
+            for state in splitter:
+                predecessors |= inverse[ch].get(state, set())
+            if not predecessors:
+                continue
+            refined = []
+            for block in partition:
+                inside, outside = block & predecessors, block - predecessors
+                if inside and outside:
+                    refined += [inside, outside]
+                    if block in waiting:
+                        waiting.remove(block)
+                        waiting += [inside, outside]
+                    else:
+                        waiting.append(min(inside, outside, key=len))
+                else:
+                    refined.append(block)
+            partition = refined
+
+    block_of = {}
+    for block in partition:
+        for state in block:
+            block_of[state] = block
+    # number the live blocks in breadth-first order from the start state
+    order, queue = {block_of[0]: 0}, deque([0])
+    new_delta, new_labels = [], []
+    while queue:
+        state = queue.popleft()
+        row = {}
+        for ch in alphabet:
+            target = delta[state].get(ch)
+            if target is None or dead in block_of[target]:
+                continue
+            block = block_of[target]
+            if block not in order:
+                order[block] = len(order)
+                queue.append(target)
+            row[ch] = order[block]
+        new_delta.append(row)
+        new_labels.append(labels[state])
+    return new_delta, new_labels
+
+
+def shortest_prefixes(delta, alphabet):
+    # the first string reaching each state, trying letters, then digits, then the other chars
+    prefixes, queue = {0: ''}, deque([0])
+    while queue:
+        state = queue.popleft()
+        for ch in alphabet:
+            target = delta[state].get(ch)
+            if target is not None and target not in prefixes:
+                prefixes[target] = prefixes[state] + ch
+                queue.append(target)
+    return prefixes
+
+
+def generate(automaton, tokens, skip=' \t\r\n'):
+    # fills an Automaton with the minimal DFA recognizing tokens, a list of (accepted_state, pattern, illegal_follow)
+    # in priority order: where two patterns match the same lexeme, the first one wins
+    # the DFA is turned into the lookahead form that Automaton.tokenize runs: a state goes to its token's
+    # accepted_state on the first char that cannot extend the lexeme, which is then read again,
+    # unless that char matches the token's illegal_follow pattern (a single char class, or None),
+    # which makes it 'illegal' instead; a lexeme that cannot be extended nor accepted is 'illegal' as well,
+    # and chars in skip separate tokens
+    # the non-final states are named after the shortest lexeme prefix that reaches them
+    # the chars outside Sigma are Automaton.OTHER to the patterns, so strings and comments may hold them
+    # while anywhere else they are illegal
+    sigma = automaton.Sigma | {automaton.OTHER}
+    alphabet = sorted(sigma, key=lambda ch: (len(ch) > 1, not ch.islower(), not ch.isalnum(), ch))
+    nfa = NFA(sigma)
+    starts = [nfa.add(pattern, token) for token, (name, pattern, follow) in enumerate(tokens)]
+    delta, labels = minimize(*subset_construction(nfa, starts, alphabet), alphabet)
+    if labels[0] is not None:
+        raise ValueError('%s matches the empty string' % tokens[labels[0]][0])
+
+    follows = [chars_of(follow, sigma) if follow is not None else set() for name, pattern, follow in tokens]
+    prefixes = shortest_prefixes(delta, alphabet)
+    names = ['initial'] + [prefixes[state] for state in range(1, len(delta))]
+    for name in names[1:]:
+        automaton.append_state(name)
+    automaton.append_state('illegal', final=True)
+    finals = []
+    for name, pattern, follow in tokens:
+        if name not in finals:
+            automaton.append_state(name, final=True)
+            finals.append(name)
+
+    for state, row in enumerate(delta):
+        label = labels[state]
+        for ch in alphabet:
+            if ch in row:
+                target = names[row[ch]]
+            elif state == 0:
+                target = 'initial' if ch in skip else 'illegal'
+            elif label is None or ch in follows[label]:
+                target = 'illegal'
+            else:
+                target = tokens[label][0]
+            automaton.append_transition(names[state], target, [ch])
+    for name in ['illegal'] + finals:
+        automaton.append_transition(name, name, sigma)
+    return automaton
+
+
+if __name__ == "__main__":
+    from automaton import Automaton, TOKENS
+    automaton = generate(Automaton(), TOKENS)
+    print(automaton.states)
+    print(len(automaton.transition), 'transitions')
+    automaton.compile()
+    print(list(automaton.tokenize("x_1 >= 1.5 /* comment */ 'str'")))
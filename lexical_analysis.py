@@ -1,35 +1,117 @@
+import argparse
+import instrument
+import os
 from automaton import ParserAutomaton
-from token import TokenCollection
+from cache import token_cache
+from instrument import profiler
+from token_collection import TokenCollection
 
-src_name = 'script'
-src_path = src_name + '.simple'
+trace_levels = {'off': ParserAutomaton.TRACE_OFF, 'tokens': ParserAutomaton.TRACE_TOKENS,
+                'full': ParserAutomaton.TRACE_FULL}
+
+arg_parser = argparse.ArgumentParser()
+arg_parser.add_argument("--input", default='script.simple', help='path to input source file of simple language')
+arg_parser.add_argument("--chunk-size", type=int, default=1 << 16, help='read the source this many chars at a time')
+arg_parser.add_argument("--verbose", action='store_true', help='print every token as it is accepted')
+arg_parser.add_argument("--no-list", action='store_true',
+                        help='do not keep the token list in memory, only the on-the-fly .lex file is written')
+arg_parser.add_argument("--trace", choices=trace_levels, default='off',
+                        help='write an automaton trace to the .log file: per token or per character')
+arg_parser.add_argument("--flush-every", type=int, default=256,
+                        help='flush the on-the-fly .lex file after this many tokens')
+arg_parser.add_argument("--flush-interval", type=float, default=1.0,
+                        help='flush the on-the-fly .lex file at least this often, in seconds')
+arg_parser.add_argument("--no-timestamps", action='store_true',
+                        help='do not prefix on-the-fly tokens with a timestamp')
+arg_parser.add_argument("--binary", action='store_true',
+                        help='also write the token list and symbol table as a binary .slex stream')
+arg_parser.add_argument("--cache", default=None,
+                        help='directory of cached token lists, reused for unchanged sources (not with --trace, '
+                             '--verbose or --no-list)')
+arg_parser.add_argument("--cache-size", type=int, default=64, help='size limit of the cache directory, in MB')
+instrument.add_arguments(arg_parser)
+opt = arg_parser.parse_args()
+instrument.start(opt)
+
+src_path = opt.input
+src_name = os.path.splitext(src_path)[0]
 lex_path1 = src_name + '_on_the_fly.lex'
 lex_path2 = src_name + '_together.lex'
 set_path = src_name + '.set'
 log_path = src_name + '.log'
+bin_path = src_name + '.slex'
 key_path = 'keywords.txt'
 
-parser = ParserAutomaton()
-
 with open(key_path) as fk:
     keywords = ''.join(fk.readlines()).split()
 
-collection = TokenCollection(keywords, lex_path1, set_path, write_on_the_fly=True)
-
-with open(src_path) as fi, open(log_path, 'w') as fl:
-    for line in fi.readlines():
-        for ch in line[:-1] + ' ':  # replace the last \n character with space
-            final = parser.process(ch)
-            print('current char = %s, final = %s' % (ch, final))
-            if final:
-                fl.writelines(['(%s,%s)-->%s, current-lex=%s\n' % tup for tup in parser.logs])
-                fl.write('----------------------%s----------------------\n\n' % parser.current_lex)
-                if parser.current_state == 'illegal':
-                    raise KeyError('illegal state encountered')
-                collection.append(parser.current_lex, parser.current_state)
-                # TODO: Roll Back
-                parser.start_over()
-                parser.process(ch)
-
-collection.write_list(lex_path2)
-collection.write_set()
+
+def lex(src_path, parser, chunk_size=1 << 16, verbose=False, on_chunk=None):
+    # yields (lexeme, accepted_state) from a source file of any size, reading it chunk by chunk
+    end = 0
+    with open(src_path) as fi:
+        for lexeme, state, start, end in parser.tokenize_stream(fi, chunk_size, on_chunk):
+            if verbose:
+                print('token = %s, state = %s, span = [%d, %d)' % (lexeme, state, start, end))
+            if state == 'illegal':
+                raise KeyError('illegal state encountered at %d: %s' % (start, lexeme))
+            yield lexeme, state
+    profiler.count('chars scanned', end)
+
+
+# trace records stream through a buffered file, nothing is kept in memory
+fl = open(log_path, 'w', buffering=1 << 16) if opt.trace != 'off' else None
+with profiler.phase('automaton'):
+    parser = ParserAutomaton(keywords, trace_levels[opt.trace], fl)
+
+# a cache hit replays the (lexeme, accepted_state) pairs of an earlier run instead of lexing,
+# the entries are keyed to the automaton tables and the keyword list as well as the source
+cache, source, tokens = None, None, None
+if opt.cache and opt.trace == 'off' and not opt.verbose and not opt.no_list:
+    with profiler.phase('cache'):
+        cache = token_cache(opt.cache, parser, keywords, opt.cache_size << 20)
+        with open(src_path, 'rb') as fb:
+            source = fb.read()
+        tokens = cache.get(source)
+
+with TokenCollection(keywords, lex_path1, set_path, write_on_the_fly=True,
+                     flush_every=opt.flush_every, flush_interval=opt.flush_interval,
+                     timestamps=not opt.no_timestamps, keep_list=not opt.no_list) as collection:
+    if tokens is None:
+        # the on-the-fly file is flushed before each read, see TokenStreamWriter
+        tokens = lex(src_path, parser, opt.chunk_size, opt.verbose, collection.writer.flush)
+        if profiler.enabled:
+            # the lexing happens as the tokens are pulled, so it is timed token by token,
+            # separately from appending them and from the on-the-fly writes that appending triggers
+            tokens = profiler.timed(tokens, 'tokenize')
+        if cache:
+            tokens = list(tokens)
+            with profiler.phase('cache'):
+                cache.put(source, tokens)
+    if profiler.enabled:
+        profiler.instrument(collection, 'append', 'collect')
+        write, per_type = profiler.wrap(collection.writer.write, 'write_on_the_fly'), profiler.group('tokens per type')
+
+        def counted_write(ID, index):
+            per_type[collection.ID2type[ID]] += 1
+            write(ID, index)
+
+        collection.writer.write = counted_write
+    for lexeme, state in tokens:
+        collection.append(lexeme, state)
+
+if fl:
+    fl.close()
+
+with profiler.phase('write_list'):
+    if not opt.no_list:
+        collection.write_list(lex_path2)
+with profiler.phase('write_set'):
+    collection.write_set()
+with profiler.phase('write_binary'):
+    if opt.binary and not opt.no_list:
+        collection.write_binary(bin_path)
+
+if profiler.enabled:
+    profiler.count('tokens', sum(profiler.group('tokens per type').values()))
+instrument.finish(opt)
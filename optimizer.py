@@ -0,0 +1,143 @@
+from AbstractSyntaxTree import Node
+
+# productions that only pass their single child through
+WRAPPERS = {'expression', 'arithmetic_expression', 'term', 'factor', 'arithmetic_value',
+            'boolean_expression', 'boolean_term', 'boolean_factor', 'boolean_value',
+            'character_expression', 'character_value',
+            'execution_clause', 'simple_clause', 'structured_clause'}
+
+RELATIONS = {'<': int.__lt__, '<=': int.__le__, '>': int.__gt__, '>=': int.__ge__, '=': int.__eq__,
+             '<>': int.__ne__}
+
+
+def integer(value):
+    return Node(type='integer', leaf=value)
+
+
+def boolean(value):
+    return Node(type='boolean_constant', leaf='true' if value else 'false')
+
+
+def empty_clause():
+    return Node(type='compound_clause', children=[Node(type='clause_table')], leaf=['begin', 'end'])
+
+
+def is_empty_clause(node):
+    return node.type == 'compound_clause' and not node.children[0].children
+
+
+def truth(node):
+    # True or False for a boolean_constant, None for anything else
+    if node is not None and node.type == 'boolean_constant':
+        return node.leaf.lower() == 'true'
+    return None
+
+
+class Optimizer:
+    # folds constant arithmetic and boolean subexpressions, collapses single-child wrapper chains,
+    # and drops statically dead if/while/repeat branches
+    # the tree is rewritten bottom-up in place; optimize() returns the new root
+    # expressions cannot call procedures, so dropping or reordering their evaluation is safe
+    def optimize(self, root):
+        replacement = {}
+        for node, depth in root.postorder():
+            node.children = [child if child is None else replacement.pop(id(child)) for child in node.children]
+            replacement[id(node)] = self.rewrite(node)
+        return replacement[id(root)]
+
+    def rewrite(self, node):
+        rule = getattr(self, 'rewrite_' + node.type, None)
+        if rule is not None:
+            result = rule(node)
+            if result is not node:
+                return result
+        if node.type in WRAPPERS and len(node.children) == 1 and self.is_passthrough(node):
+            return node.children[0]
+        return node
+
+    @staticmethod
+    def is_passthrough(node):
+        if node.type == 'factor':
+            return True  # parentheses carry no meaning once the tree is built
+        if node.type == 'arithmetic_expression':
+            return node.leaf in (None, '+')
+        return node.leaf is None
+
+    def rewrite_arithmetic_expression(self, node):
+        children = node.children
+        if len(children) == 1:
+            if node.leaf == '-' and children[0].type == 'integer':
+                return integer(-children[0].leaf)
+            return node
+        return self.fold_arithmetic(node)
+
+    def rewrite_term(self, node):
+        return self.fold_arithmetic(node) if len(node.children) == 2 else node
+
+    @staticmethod
+    def fold_arithmetic(node):
+        left, right = node.children
+        if left.type != 'integer' or right.type != 'integer':
+            return node
+        a, b = left.leaf, right.leaf
+        if node.leaf == '+':
+            return integer(a + b)
+        if node.leaf == '-':
+            return integer(a - b)
+        if node.leaf == '*':
+            return integer(a * b)
+        if b == 0:
+            return node  # left for the VM to report
+        return integer(a // b)  # '/' on integers is floor division, as DIV in bytecode.py
+
+    def rewrite_boolean_expression(self, node):
+        return self.fold_logic(node, True) if len(node.children) == 2 else node
+
+    def rewrite_boolean_term(self, node):
+        return self.fold_logic(node, False) if len(node.children) == 2 else node
+
+    @staticmethod
+    def fold_logic(node, dominant):
+        # 'or' is decided by a true operand and 'and' by a false one, the other constant is neutral
+        left, right = node.children
+        for constant, other in ((left, right), (right, left)):
+            value = truth(constant)
+            if value == dominant:
+                return boolean(dominant)
+            if value is not None:
+                return other
+        return node
+
+    def rewrite_boolean_factor(self, node):
+        value = truth(node.children[0])
+        if node.leaf is not None and value is not None:
+            return boolean(not value)
+        return node
+
+    def rewrite_boolean_value(self, node):
+        children = node.children
+        if len(children) == 3 and children[0].type == 'integer' and children[2].type == 'integer':
+            return boolean(RELATIONS[children[1].leaf](children[0].leaf, children[2].leaf))
+        return node
+
+    def rewrite_if_clause(self, node):
+        value = truth(node.children[0])
+        if value is None:
+            return node
+        if value:
+            return node.children[1]
+        return node.children[2] if len(node.children) == 3 else empty_clause()
+
+    def rewrite_while_clause(self, node):
+        return empty_clause() if truth(node.children[0]) is False else node
+
+    def rewrite_repeat_clause(self, node):
+        return node.children[0] if truth(node.children[1]) is True else node
+
+    def rewrite_clause_table(self, node):
+        node.children = [child for child in node.children if not is_empty_clause(child)]
+        return node
+
+
+def optimize(root):
+    return Optimizer().optimize(root)
@@ -1,12 +1,16 @@
 import ply.lex as lex
 import ply.yacc as yacc
 import argparse
+import hashlib
+import instrument
+import json
+import struct
+import sys
 from AbstractSyntaxTree import Node
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--input", required=True, help='path to input source file of simple language')
-opt = parser.parse_args()
-print(opt)
+from cache import AnalysisCache, fingerprint
+from FlatSyntaxTree import FlatTree, TreeFile
+from instrument import profiler
+from symbol_table import SymbolTable
 
 # perform lexical analysis
 
@@ -37,7 +41,7 @@ tokens = tokens + list(reserved.values())
 literals = "+-*/=<>()[]:.;,'_"
 
 # define a series of regex for each type of token
-t_STRING_LITERAL = r"\'.*\'"
+t_STRING_LITERAL = r"\'[^'\n]*\'"
 t_NEQ = r'<>'
 t_LE = r'<='
 t_GE = r'>='
@@ -46,7 +50,7 @@ t_ELLIPSIS = r'\.\.'
 
 
 def t_COMMENT(t):
-    r'\/\*.*\*\/'
+    r'\/\*.*?\*\/'
     pass  # returns nothing since comments do not go through compiler
 
 
@@ -57,7 +61,7 @@ def t_NUMBER(t):
 
 
 def t_ID(t):  # the underscore is added for purpose of generality
-    r'[a-zA-Z_][a-zA-z_0-9]*'
+    r'[a-zA-Z_][a-zA-Z_0-9]*'
     t.type = reserved.get(t.value, 'ID')
     return t
 
@@ -76,20 +80,11 @@ def t_error(t):
     t.lexer.skip(1)
 
 
-# instantiate a lex object, named lexer
-lexer = lex.lex(debug=1)
-lexer.lineno = 1
-
-# feed input to lexer
-with open(opt.input) as f:
-    lexer.input(f.read())
-
-# get a list of all tokens returned by lexer.token() and the symbol table
-toks = list(lexer)
-symbols = set(tok.value for tok in toks if tok.type == "ID")
 
 
 # perform syntactic analysis
+# the actions also fill in the SymbolTable of the current parse, kept on the lexer as p.lexer.symbols:
+# declarations are entered as they are reduced and uses resolved against what is visible at that point
 
 # 0
 def p_empty(p):
@@ -135,6 +130,7 @@ def p_character_constant(p):
 # 13
 def p_constant_identifier(p):
     """  constant_identifier : identifier """
+    p.lexer.symbols.resolve(p[1])
     p[0] = Node(type='constant_identifier', children=[p[1]])
 
 
@@ -186,7 +182,7 @@ def p_expression(p):
     """  expression : arithmetic_expression
                     | boolean_expression
                     | character_expression """
-    p[0] = Node(type='expression', leaf=p[1])
+    p[0] = Node(type='expression', children=[p[1]])
 
 
 # 20
@@ -229,6 +225,8 @@ def p_factor(p):
 def p_arithmetic_value(p):
     """  arithmetic_value : identifier
                           | integer """
+    if p[1].type == 'identifier':
+        p.lexer.symbols.resolve(p[1])
     p[0] = Node(type='arithmetic_value', children=[p[1]])
 
 
@@ -269,8 +267,12 @@ def p_boolean_value(p):
                        | '(' boolean_expression ')' identifier  relation_symbol  identifier
                        | '(' arithmetic_expression ')' relation_symbol  '(' arithmetic_expression ')' """
     if len(p) == 2:
+        if p[1].type == 'identifier':
+            p.lexer.symbols.resolve(p[1])
         p[0] = Node(type='boolean_value', children=[p[1]])
     elif len(p) == 7:
+        p.lexer.symbols.resolve(p[4])
+        p.lexer.symbols.resolve(p[6])
         p[0] = Node(type='boolean_value', children=[p[2], p[4], p[5], p[6]], leaf=[p[1], p[3]])
     else:
         p[0] = Node(type="boolean_value", children=[p[2], p[4], p[6]], leaf=[p[1], p[3], p[5], p[7]])
@@ -286,6 +288,8 @@ def p_character_expression(p):
 def p_character_value(p):
     """  character_value : character_constant
                          | identifier """
+    if p[1].type == 'identifier':
+        p.lexer.symbols.resolve(p[1])
     p[0] = Node(type='character_value', children=[p[1]])
 
 
@@ -327,13 +331,18 @@ def p_constant_declaration(p):
 
 
 # 34
+# list productions are left-recursive and reduce into one flat node: the first element creates it
+# and every further one is appended, leaf holds what the outermost nested node used to
 def p_constant_definition(p):
-    """  constant_definition : identifier '=' constant ';' constant_definition
+    """  constant_definition : constant_definition identifier '=' constant ';'
                              | identifier '=' constant ';' """
-    if len(p) == 6:
-        p[0] = Node(type='constant_definition', children=[p[1], p[3], p[5]], leaf=[p[2], p[4]])
-    else:
+    if len(p) == 5:
+        p.lexer.symbols.declare_constant(p[1], p[3])
         p[0] = Node(type='constant_definition', children=[p[1], p[3]], leaf=[p[2], p[4]])
+    else:
+        p.lexer.symbols.declare_constant(p[2], p[4])
+        p[0] = p[1]
+        p[0].children += [p[2], p[4]]
 
 
 # 35
@@ -348,22 +357,27 @@ def p_variable_declaration(p):
 
 # 36
 def p_variable_definition(p):
-    """  variable_definition : identifier_table ':' type ';'
-                             | identifier_table ':' type ';' variable_definition """
+    """  variable_definition : variable_definition identifier_table ':' type ';'
+                             | identifier_table ':' type ';' """
     if len(p) == 5:
+        p.lexer.symbols.declare_variables(p[1], p[3])
         p[0] = Node(type='variable_definition', children=[p[1], p[3]], leaf=[p[2], p[4]])
     else:
-        p[0] = Node(type='variable_definition', children=[p[1], p[3], p[5]], leaf=[p[2], p[4]])
+        p.lexer.symbols.declare_variables(p[2], p[4])
+        p[0] = p[1]
+        p[0].children += [p[2], p[4]]
 
 
 # 37
 def p_identifier_table(p):
-    """  identifier_table : identifier ',' identifier_table
+    """  identifier_table : identifier_table ',' identifier
                           | identifier """
     if len(p) == 2:
         p[0] = Node(type='identifier_table', children=[p[1]])
     else:
-        p[0] = Node(type='identifier_table', children=[p[1], p[3]], leaf=p[2])
+        p[0] = p[1]
+        p[0].children.append(p[3])
+        p[0].leaf = p[2]
 
 
 # 38
@@ -385,6 +399,7 @@ def p_simple_clause(p):
 # 40
 def p_assignment(p):
     """  assignment : variable ASSIGNMENT expression """
+    p.lexer.symbols.resolve_variable(p[1])
     p[0] = Node(type='assignment', children=[p[1], p[3]], leaf=p[2])
 
 
@@ -409,28 +424,33 @@ def p_index_variable(p):
 
 # 44
 def p_expression_table(p):
-    """  expression_table : expression ',' expression_table
+    """  expression_table : expression_table ',' expression
                           | expression """
     if len(p) == 2:
         p[0] = Node(type='expression_table', children=[p[1]])
     else:
-        p[0] = Node(type='expression_table', children=[p[1], p[3]], leaf=p[2])
+        p[0] = p[1]
+        p[0].children.append(p[3])
+        p[0].leaf = p[2]
 
 
 # 45
 def p_calling(p):
     """  calling : CALL identifier  '(' real_parameter_table ')' """
+    p.lexer.symbols.resolve(p[2])
     p[0] = Node(type='calling', children=[p[2], p[4]], leaf=[p[1], p[3], p[5]])
 
 
 # 46
 def p_real_parameter_table(p):
-    """  real_parameter_table : expression ',' real_parameter_table
+    """  real_parameter_table : real_parameter_table ',' expression
                               | expression """
     if len(p) == 2:
         p[0] = Node(type='real_parameter_table', children=[p[1]])
     else:
-        p[0] = Node(type='real_parameter_table', children=[p[1], p[3]], leaf=p[2])
+        p[0] = p[1]
+        p[0].children.append(p[3])
+        p[0].leaf = p[2]
 
 
 # 47
@@ -441,12 +461,15 @@ def p_read_clause(p):
 
 # 48
 def p_input_variable_table(p):
-    """  input_variable_table : variable
-                              | variable ',' input_variable_table """
+    """  input_variable_table : input_variable_table ',' variable
+                              | variable """
+    p.lexer.symbols.resolve_variable(p[len(p) - 1])
     if len(p) == 2:
         p[0] = Node(type='input_variable_table', children=[p[1]])
     else:
-        p[0] = Node(type='input_variable_table', children=[p[1], p[3]], leaf=p[2])
+        p[0] = p[1]
+        p[0].children.append(p[3])
+        p[0].leaf = p[2]
 
 
 # 49
@@ -473,12 +496,14 @@ def p_compound_clause(p):
 
 # 52
 def p_clause_table(p):
-    """  clause_table : execution_clause ';' clause_table
+    """  clause_table : clause_table ';' execution_clause
                       | execution_clause """
     if len(p) == 2:
         p[0] = Node(type='clause_table', children=[p[1]])
     else:
-        p[0] = Node(type='clause_table', children=[p[1], p[3]], leaf=p[2])
+        p[0] = p[1]
+        p[0].children.append(p[3])
+        p[0].leaf = p[2]
 
 
 # 53
@@ -506,27 +531,45 @@ def p_repeat_clause(p):
 # 56
 def p_for_clause(p):
     """  for_clause : FOR variable ASSIGNMENT expression TO expression DO execution_clause """
+    p.lexer.symbols.resolve_variable(p[2])
     p[0] = Node(type='for_clause', children=[p[2], p[4], p[6], p[8]], leaf=[p[1], p[3], p[5], p[7]])
 
 
 # 57
 def p_procedure_declaration(p):
-    """  procedure_declaration : PROCEDURE identifier  '(' formal_parameter_table ')' subroutine
+    """  procedure_declaration : procedure_heading '(' formal_parameter_table ')' subroutine
                                | empty """
     if len(p) == 2:
         p[0] = Node(type='procedure_declaration', children=[p[1]])
     else:
-        p[0] = Node(type='procedure_declaration', children=[p[2], p[4], p[6]], leaf=[p[1], p[3], p[5]])
+        p.lexer.symbols.close()
+        keyword, identifier = p[1]
+        p[0] = Node(type='procedure_declaration', children=[identifier, p[3], p[5]], leaf=[keyword, p[2], p[4]])
+
+
+# reduced as soon as the procedure name is read, before the parameters:
+# the name goes into the enclosing scope, so calls resolve from there and from within the body,
+# and the parameters and everything declared by the subroutine go into the new scope
+# (an empty embedded action would do the same, but PLY's error recovery can loop on it)
+def p_procedure_heading(p):
+    """  procedure_heading : PROCEDURE identifier """
+    p.lexer.symbols.declare(p[2], 'procedure')
+    p.lexer.symbols.open(p[2].leaf)
+    p[0] = (p[1], p[2])
 
 
 # 58
 def p_formal_parameter_table(p):
-    """  formal_parameter_table : variable ':' simple_type
-                                | variable ':' simple_type ',' formal_parameter_table """
+    """  formal_parameter_table : formal_parameter_table ',' variable ':' simple_type
+                                | variable ':' simple_type """
     if len(p) == 4:
+        p.lexer.symbols.declare_parameter(p[1], p[3])
         p[0] = Node(type='formal_parameter_table', children=[p[1], p[3]], leaf=p[2])
     else:
-        p[0] = Node(type='formal_parameter_table', children=[p[1], p[3], p[5]], leaf=[p[2], p[4]])
+        p.lexer.symbols.declare_parameter(p[3], p[5])
+        p[0] = p[1]
+        p[0].children += [p[3], p[5]]
+        p[0].leaf = [p[4], p[2]]
 
 
 # 59
@@ -538,6 +581,7 @@ def p_subroutine(p):
 # 60
 def p_program(p):
     """  program : PROGRAM identifier  subroutine """
+    p.lexer.symbols.scopes[0].name = p[2].leaf
     p[0] = Node(type='program', children=[p[2], p[3]], leaf=p[1])
 
 
@@ -545,22 +589,222 @@ def p_error(p):
     print("Error at token", p, "detected")
 
 
-parser = yacc.yacc(debug=1, start='program')
+def grammar_signature():
+    # hash of everything the lexer and parser tables are generated from
+    module = sys.modules[__name__]
+    parts = [repr(tokens), literals]
+    for name in sorted(vars(module)):
+        if name.startswith(('t_', 'p_')):
+            rule = getattr(module, name)
+            parts.append('%s:%s' % (name, rule.__doc__ if callable(rule) else rule))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def build(debug=False, start='program'):
+    # in debug mode the tables are regenerated and logged, along with parser.out
+    # otherwise they are loaded from lextab_<signature>.py and parsetab_<signature>.py,
+    # which are written next to this file the first time a grammar is seen
+    # a start symbol other than program gets its own parsetab_<start>_<signature>.py
+    if debug:
+        return lex.lex(debug=1), yacc.yacc(debug=1, start=start)
+    signature = grammar_signature()
+    tabmodule = 'parsetab_' + signature if start == 'program' else 'parsetab_%s_%s' % (start, signature)
+    lexer = lex.lex(optimize=1, lextab='lextab_' + signature, errorlog=lex.NullLogger())
+    parser = yacc.yacc(debug=False, optimize=True, start=start, tabmodule=tabmodule, errorlog=yacc.NullLogger())
+    return lexer, parser
+
+
+# a cached analysis is a uint32 length and that many bytes of JSON holding the token fields and the
+# SymbolTable.to_dict() of the symbols, followed by the AST as a binary tree (see FlatSyntaxTree), if any;
+# both are flat, so no AST is too deep to be cached, and reading an entry back runs no code
+ANALYSIS_LENGTH = struct.Struct('<I')
+
+
+def encode_analysis(value):
+    fields, symbols, result = value
+    nodes = []
+    tree = FlatTree.from_node(result, placeholders=True, nodes=nodes) if result is not None else None
+    index_of = {node: i for i, node in enumerate(nodes) if node is not None}
+    header = json.dumps({'tokens': fields, 'symbols': symbols.to_dict(index_of)}, separators=(',', ':'))
+    header = header.encode('utf-8')
+    return ANALYSIS_LENGTH.pack(len(header)) + header + (tree.to_bytes() if tree is not None else b'')
+
+
+def decode_analysis(data):
+    length, = ANALYSIS_LENGTH.unpack_from(data, 0)
+    start = ANALYSIS_LENGTH.size + length
+    header = json.loads(data[ANALYSIS_LENGTH.size:start].decode('utf-8'))
+    nodes = []
+    if start < len(data):
+        tree = TreeFile.from_bytes(data[start:])
+        nodes = tree.to_nodes()
+        tree.close()
+    symbols = SymbolTable.from_dict(header['symbols'], nodes)
+    return header['tokens'], symbols, nodes[0] if nodes else None
+
+
+def analysis_cache(directory, max_bytes=64 << 20):
+    # an AnalysisCache for SimpleCompiler.analyze, its entries are keyed to the current grammar
+    return AnalysisCache(directory, fingerprint('simple_analyzer', grammar_signature()), max_bytes,
+                         encode_analysis, decode_analysis)
+
+
+def make_token(type, value, lineno, lexpos):
+    tok = lex.LexToken()
+    tok.type, tok.value, tok.lineno, tok.lexpos = type, value, lineno, lexpos
+    return tok
+
+
+class SimpleCompiler:
+    # front end with the lexer and parser built once, parse() and analyze() can be called repeatedly
+    # a PLY lexer keeps its input as state, so use one SimpleCompiler per thread
+    # symbols is the SymbolTable of the last parse
+    # with an AnalysisCache, analyze() loads a source seen before from the cache without lexing or parsing it
+    # while the profiler is enabled, PLY lexing is timed as the phase 'lex' inside 'parse'
+    # and the reductions and grammar actions are counted and timed as well, see instrument.py
+    def __init__(self, debug=False, cache=None):
+        # instantiate a lex object, named lexer, and the parser
+        with profiler.phase('build'):
+            self.lexer, self.parser = build(debug)
+        if profiler.enabled:
+            profiler.instrument_parser(self.parser)
+        self.symbols = None
+        self.cache = cache
+
+    def reset(self):
+        self.lexer.lineno = 1
+        self.lexer.symbols = self.symbols = SymbolTable()
+
+    @staticmethod
+    def read(source):
+        return source.read() if hasattr(source, 'read') else source
+
+    def parse(self, source):
+        # source is a string or a readable file object, returns the root Node or None on a syntax error
+        self.reset()
+        source = self.read(source)
+        with profiler.phase('parse'):
+            tokenfunc = profiler.wrap(self.lexer.token, 'lex') if profiler.enabled else None
+            return self.parser.parse(source, lexer=self.lexer, tokenfunc=tokenfunc)
+
+    def analyze(self, source, keep_tokens=True):
+        # returns the token list, the SymbolTable and the AST from a single lexing pass:
+        # the tokens are recorded as the parser pulls them from the lexer, toks is None unless keep_tokens
+        source = self.read(source)
+        if self.cache is None:
+            return self.__analyze(source, keep_tokens)
+        with profiler.phase('cache'):
+            cached = self.cache.get(source)
+        if cached is None:
+            toks, symbols, result = self.__analyze(source, True)
+            with profiler.phase('cache'):
+                fields = [(tok.type, tok.value, tok.lineno, tok.lexpos) for tok in toks]
+                self.cache.put(source, (fields, symbols, result))
+        else:
+            fields, symbols, result = cached
+            toks = [make_token(*field) for field in fields] if keep_tokens else None
+            self.symbols = symbols
+        return toks if keep_tokens else None, symbols, result
+
+    def __analyze(self, source, keep_tokens):
+        if not keep_tokens:
+            result = self.parse(source)
+            return None, self.symbols, result
+        toks = []
+        next_token = self.lexer.token
+        if profiler.enabled:
+            next_token = profiler.wrap(next_token, 'lex')
+
+        def record():
+            tok = next_token()
+            if tok is not None:
+                toks.append(tok)
+            return tok
+
+        self.reset()
+        with profiler.phase('parse'):
+            result = self.parser.parse(source, lexer=self.lexer, tokenfunc=record)
+            while record() is not None:
+                pass  # a syntax error can stop the parser before the end of input
+        return toks, self.symbols, result
+
+
+default_compiler = None
+
+
+def get_compiler():
+    global default_compiler
+    if default_compiler is None:
+        default_compiler = SimpleCompiler()
+    return default_compiler
+
+
+def parse(source):
+    return get_compiler().parse(source)
+
+
+def analyze(source, keep_tokens=True):
+    return get_compiler().analyze(source, keep_tokens)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--input", required=True, help='path to input source file of simple language')
+    arg_parser.add_argument("--debug", action='store_true', help='regenerate the tables and write PLY debug output')
+    arg_parser.add_argument("--no-tokens", action='store_true', help='do not keep or print the token list')
+    arg_parser.add_argument("--optimize", action='store_true', help='fold constants and drop dead branches in the AST')
+    arg_parser.add_argument("--cache", default=None, help='directory of cached results, reused for unchanged sources')
+    arg_parser.add_argument("--cache-size", type=int, default=64, help='size limit of the cache directory, in MB')
+    arg_parser.add_argument("--save-ast", default=None, help='also write the AST to this path as a binary .sast tree')
+    instrument.add_arguments(arg_parser)
+    opt = arg_parser.parse_args(argv)
+    print(opt)
+    instrument.start(opt)
+
+    cache = analysis_cache(opt.cache, opt.cache_size << 20) if opt.cache else None
+    compiler = SimpleCompiler(debug=opt.debug, cache=cache)
+    with open(opt.input) as f:
+        with profiler.phase('read'):
+            source = f.read()
+        toks, symbols, result = compiler.analyze(source, keep_tokens=not opt.no_tokens)
+
+    if profiler.enabled:
+        profiler.count('chars scanned', len(source))
+        if toks is not None:
+            profiler.count('tokens', len(toks))
+            profiler.tally('tokens per type', (tok.type for tok in toks))
+        if result is not None:
+            profiler.tally('nodes per type', (node.type for node, depth in result.preorder()))
+        profiler.count('symbols', len(symbols))
+
+    if toks is not None:
+        print('token list = [')
+        for tok in toks: print("    ", tok, ",")
+        print(']\n')
+
+    print('symbol table = [')
+    for sym in symbols: print("    ", sym, ",")
+    print("]\n")
+    for error in symbols.errors.values(): print(error)
 
-with open(opt.input) as f:
-    # re-initialize the line number
-    lexer.lineno = 1
-    result = parser.parse(f.read())
+    if result is None:
+        instrument.finish(opt)
+        sys.exit('syntax error in %s' % opt.input)
 
-if __name__ == "__main__":
-    print('token list = [')
-    for tok in toks: print("    ", tok, ",")
-    print(']\n')
+    if opt.optimize:
+        from optimizer import optimize
+        with profiler.phase('optimize'):
+            result = optimize(result)
 
-    print('symbol list = [')
-    for sym in symbols: print("    ", sym, ",")
-    print("]\n")
+    if opt.save_ast:
+        from FlatSyntaxTree import save_tree
+        with profiler.phase('save_ast'):
+            save_tree(result, opt.save_ast)
 
     print("Abstract Syntax Tree")
     result.traverse()
+    instrument.finish(opt)
+
 
+if __name__ == "__main__":
+    main()
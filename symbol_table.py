@@ -0,0 +1,281 @@
+from AbstractSyntaxTree import Node
+
+# declared type of each kind of constant node
+CONSTANT_TYPES = {'integer': 'integer', 'boolean_constant': 'bool', 'character_constant': 'char',
+                  'real_number': 'real'}
+
+
+def array_dims(node):
+    # index : integer | integer .. integer | index , integer | index , integer .. integer
+    # returns [(low, size), ...], a bare integer n means the bounds 0..n-1
+    children = node.children
+    if len(children) == 1:
+        return [(0, children[0].leaf)]
+    if node.leaf == '..':
+        return [(children[0].leaf, children[1].leaf - children[0].leaf + 1)]
+    if node.leaf == ',':
+        return array_dims(children[0]) + [(0, children[1].leaf)]
+    return array_dims(children[0]) + [(children[1].leaf, children[2].leaf - children[1].leaf + 1)]
+
+
+# the kinds of Symbol that take storage in the frame of their scope
+STORAGE = ('variable', 'parameter')
+
+
+class Symbol:
+    # one declared name
+    # kind is 'constant', 'variable', 'parameter' or 'procedure'
+    # slot is the offset of a variable or parameter in the storage of its scope, which an array fills with
+    # `size` consecutive slots, one per element in row-major order; the parameters of a procedure come first
+    # constants and procedures take no storage and their slot is None
+    # type is a simple type name ('integer', 'real', 'bool', 'char'), None for procedures
+    # dims is [(low, size), ...] for arrays and None otherwise
+    __slots__ = ('name', 'kind', 'scope', 'slot', 'type', 'dims')
+
+    def __init__(self, name, kind, scope, slot, type=None, dims=None):
+        self.name = name
+        self.kind = kind
+        self.scope = scope
+        self.slot = slot
+        self.type = type
+        self.dims = dims
+
+    @property
+    def size(self):
+        # number of slots taken
+        size = 1
+        for low, length in self.dims or ():
+            size *= length
+        return size
+
+    def __repr__(self):
+        type = self.type if self.dims is None else '%s%s' % (self.type, self.dims)
+        slot = '-' if self.slot is None else self.slot
+        return '%s: %s %s (%d, %s)' % (self.name, type or '-', self.kind, self.scope, slot)
+
+
+class Scope:
+    # the program body is scope 0 at level 0, every procedure opens a scope one level below its parent
+    __slots__ = ('index', 'name', 'parent', 'level', 'names', 'symbols', 'size')
+
+    def __init__(self, index, name, parent=None):
+        self.index = index
+        self.name = name
+        self.parent = parent
+        self.level = 0 if parent is None else parent.level + 1
+        self.names = {}  # name -> Symbol
+        self.symbols = []  # Symbols in declaration order
+        self.size = 0  # slots taken by its variables and parameters
+
+
+class SymbolTable:
+    # built by the parser actions as declarations are reduced, see simple_analyzer
+    # visible maps a name to the stack of Symbols currently in scope, innermost last, so resolving
+    # a use is a single dict lookup rather than a walk up the scope chain
+    # resolved maps each identifier Node that uses a name to its Symbol
+    # errors maps the identifier Node of each duplicate declaration or undeclared use to a message
+    def __init__(self):
+        self.scopes = [Scope(0, None)]
+        self.current = self.scopes[0]
+        self.visible = {}
+        self.resolved = {}
+        self.errors = {}
+
+    def __iter__(self):
+        # all Symbols, scope by scope in the order the scopes were opened
+        for scope in self.scopes:
+            yield from scope.symbols
+
+    def __len__(self):
+        return sum(len(scope.symbols) for scope in self.scopes)
+
+    def symbol(self, scope, index):
+        # the index-th declaration of a scope
+        return self.scopes[scope].symbols[index]
+
+    def open(self, name):
+        scope = Scope(len(self.scopes), name, self.current)
+        self.scopes.append(scope)
+        self.current = scope
+        return scope
+
+    def close(self):
+        scope = self.current
+        for name in scope.names:
+            self.visible[name].pop()
+        self.current = scope.parent
+
+    def declare(self, identifier, kind, type=None, dims=None):
+        name, scope = identifier.leaf, self.current
+        if name in scope.names:
+            self.errors[identifier] = '%s declared twice in %s' % (name, self.describe(scope))
+            return scope.names[name]
+        symbol = Symbol(name, kind, scope.index, scope.size if kind in STORAGE else None, type, dims)
+        if kind in STORAGE:
+            scope.size += symbol.size
+        scope.names[name] = symbol
+        scope.symbols.append(symbol)
+        self.visible.setdefault(name, []).append(symbol)
+        return symbol
+
+    def declare_constant(self, identifier, constant):
+        value = constant.children[0]
+        if value.type == 'constant_identifier':
+            other = self.resolved.get(value.children[0])
+            type = other.type if other is not None else None
+        else:
+            type = CONSTANT_TYPES[value.type]
+        return self.declare(identifier, 'constant', type)
+
+    def declare_variables(self, identifier_table, type):
+        node = type.children[0]
+        if node.type == 'simple_type':
+            element, dims = node.leaf.lower(), None
+        else:
+            index, simple_type = node.children
+            element, dims = simple_type.leaf.lower(), array_dims(index)
+        for identifier in identifier_table.children:
+            self.declare(identifier, 'variable', element, dims)
+
+    def declare_parameter(self, variable, simple_type):
+        return self.declare(variable.children[0].children[0], 'parameter', simple_type.leaf.lower())
+
+    def lookup(self, name):
+        stack = self.visible.get(name)
+        return stack[-1] if stack else None
+
+    def resolve(self, identifier):
+        symbol = self.lookup(identifier.leaf)
+        if symbol is None:
+            self.errors[identifier] = 'undeclared identifier %s in %s' % (identifier.leaf, self.describe(self.current))
+        else:
+            self.resolved[identifier] = symbol
+        return symbol
+
+    def resolve_variable(self, variable):
+        # variable -> single_variable | index_variable, both start with the identifier
+        return self.resolve(variable.children[0].children[0])
+
+    def forget(self, root):
+        # drops what was recorded for the identifiers of a subtree that is about to be replaced
+        for node, depth in root.preorder():
+            if node.type == 'identifier':
+                self.resolved.pop(node, None)
+                self.errors.pop(node, None)
+
+    def rewind(self, n_symbols, n_scopes):
+        # undoes the declarations of the current scope after its first n_symbols,
+        # and drops the (closed) scopes opened after the first n_scopes
+        scope = self.current
+        for symbol in reversed(scope.symbols[n_symbols:]):
+            del scope.names[symbol.name]
+            self.visible[symbol.name].pop()
+            if symbol.slot is not None:
+                scope.size = symbol.slot
+        del scope.symbols[n_symbols:]
+        del self.scopes[n_scopes:]
+
+    def to_dict(self, index_of):
+        # plain lists and dicts, ready for json, the Nodes being referred to by index_of[node]
+        # (their pre-order position in a FlatTree) and the Symbols by their position in iteration order;
+        # a Node outside the tree, left by a parse that failed, is written as its [type, leaf]
+        number = {symbol: i for i, symbol in enumerate(self)}
+
+        def ref(node):
+            index = index_of.get(node)
+            return [node.type, node.leaf] if index is None else index
+
+        return {'scopes': [[scope.name, -1 if scope.parent is None else scope.parent.index] for scope in self.scopes],
+                'current': self.current.index,
+                'symbols': [[symbol.name, symbol.kind, symbol.scope, symbol.slot, symbol.type, symbol.dims]
+                            for symbol in self],
+                'resolved': [[ref(node), number[symbol]] for node, symbol in self.resolved.items()],
+                'errors': [[ref(node), message] for node, message in self.errors.items()]}
+
+    @classmethod
+    def from_dict(cls, data, nodes):
+        # the inverse of to_dict(), nodes[i] being the Node of index i
+        def node(ref):
+            return nodes[ref] if isinstance(ref, int) else Node(ref[0], leaf=ref[1])
+
+        table = cls()
+        for name, parent in data['scopes'][1:]:
+            table.scopes.append(Scope(len(table.scopes), name, table.scopes[parent]))
+        table.scopes[0].name = data['scopes'][0][0]
+        symbols = []
+        for name, kind, scope, slot, type, dims in data['symbols']:
+            dims = None if dims is None else [tuple(dim) for dim in dims]
+            symbol = Symbol(name, kind, scope, slot, type, dims)
+            table.scopes[scope].names.setdefault(name, symbol)
+            table.scopes[scope].symbols.append(symbol)
+            if slot is not None:
+                table.scopes[scope].size = slot + symbol.size
+            symbols.append(symbol)
+        table.current = table.scopes[data['current']]
+        scope, chain = table.current, []
+        while scope is not None:
+            chain.append(scope)
+            scope = scope.parent
+        for scope in reversed(chain):  # the scopes still open, outermost first
+            for name, symbol in scope.names.items():
+                table.visible.setdefault(name, []).append(symbol)
+        for ref, number in data['resolved']:
+            table.resolved[node(ref)] = symbols[number]
+        for ref, message in data['errors']:
+            table.errors[node(ref)] = message
+        return table
+
+    @classmethod
+    def from_tree(cls, root):
+        # rebuilds the table of a tree that was not just parsed, such as one loaded from a .sast file,
+        # by doing what the parser actions do in tree order; the tree may have been optimized,
+        # as an identifier that is not declared by its parent is a use wherever it ends up
+        # a None on the stack closes the scope of the procedure whose body was pushed under it
+        table = cls()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                table.close()
+                continue
+            type, children = node.type, node.children
+            if type == 'program':
+                table.scopes[0].name = children[0].leaf
+                stack.append(children[1])
+            elif type == 'constant_definition':
+                for identifier, constant in zip(children[::2], children[1::2]):
+                    if constant.children[0].type == 'constant_identifier':
+                        table.resolve(constant.children[0].children[0])
+                    table.declare_constant(identifier, constant)
+            elif type == 'variable_definition':
+                for identifier_table, variable_type in zip(children[::2], children[1::2]):
+                    table.declare_variables(identifier_table, variable_type)
+            elif type == 'procedure_declaration' and len(children) == 3:
+                identifier, parameters, subroutine = children
+                table.declare(identifier, 'procedure')
+                table.open(identifier.leaf)
+                for variable, simple_type in zip(parameters.children[::2], parameters.children[1::2]):
+                    table.declare_parameter(variable, simple_type)
+                stack += [None, subroutine]
+            elif type == 'identifier':
+                table.resolve(node)
+            else:
+                stack.extend([child for child in reversed(children) if child is not None])
+        return table
+
+    @staticmethod
+    def describe(scope):
+        return 'procedure %s' % scope.name if scope.parent is not None else 'the program body'
+
+
+if __name__ == "__main__":
+    table = SymbolTable()
+    x, y, p = Node("identifier", leaf="x"), Node("identifier", leaf="y"), Node("identifier", leaf="p")
+    table.declare(x, 'variable', 'integer')
+    table.declare(p, 'procedure')
+    table.open('p')
+    table.declare(Node("identifier", leaf="x"), 'parameter', 'real')
+    print(table.resolve(Node("identifier", leaf="x")), table.resolve(y))
+    table.close()
+    print(table.resolve(Node("identifier", leaf="x")), table.symbol(0, 1))
+    print(list(table), list(table.errors.values()))
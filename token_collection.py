@@ -0,0 +1,239 @@
+import datetime
+import mmap
+import os
+import struct
+import time
+
+
+class InternTable:
+    # insertion-ordered lexeme table, the dict gives O(1) membership and index lookups
+    def __init__(self, lexemes=()):
+        self.index_of = {}
+        self.lexemes = []
+        for lexeme in lexemes:
+            self.intern(lexeme)
+
+    def intern(self, lexeme):
+        index = self.index_of.get(lexeme)
+        if index is None:
+            index = self.index_of[lexeme] = len(self.lexemes)
+            self.lexemes.append(lexeme)
+        return index
+
+    def index(self, lexeme):
+        return self.index_of[lexeme]
+
+    def __contains__(self, lexeme):
+        return lexeme in self.index_of
+
+    def __getitem__(self, index):
+        return self.lexemes[index]
+
+    def __iter__(self):
+        return iter(self.lexemes)
+
+    def __len__(self):
+        return len(self.lexemes)
+
+
+# binary token stream (.slex):
+#   header   magic, version, number of categories, number of tokens
+#   tokens   packed (type byte, index uint32) records, little-endian
+#   pool     per category: type byte, name, string count, then the strings
+#            every string is a uint32 byte length followed by utf-8 bytes
+BINARY_MAGIC = b'SLEX'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sHHQ')
+BINARY_RECORD = struct.Struct('<BI')
+BINARY_COUNT = struct.Struct('<I')
+
+
+class TokenArrayView:
+    # read-only (type, index) sequence over a buffer of packed records, nothing is copied
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def __len__(self):
+        return len(self.buffer) // BINARY_RECORD.size
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('token index out of range')
+        return BINARY_RECORD.unpack_from(self.buffer, i * BINARY_RECORD.size)
+
+    def __iter__(self):
+        return BINARY_RECORD.iter_unpack(self.buffer)
+
+
+class TokenFile:
+    # memory-maps a .slex file; `tokens` is a zero-copy view, `set` maps type ID to its lexemes
+    def __init__(self, path):
+        error = ValueError('%s is not a version %d token stream' % (path, BINARY_VERSION))
+        with open(path, 'rb') as fi:
+            if os.fstat(fi.fileno()).st_size < BINARY_HEADER.size:
+                raise error  # mmap cannot map an empty file
+            self.mm = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_categories, n_tokens = BINARY_HEADER.unpack_from(self.mm, 0)
+        offset = BINARY_HEADER.size
+        end = offset + n_tokens * BINARY_RECORD.size
+        if magic != BINARY_MAGIC or version != BINARY_VERSION or end > len(self.mm):
+            self.mm.close()
+            raise error
+        self.view = memoryview(self.mm)
+        self.tokens = TokenArrayView(self.view[offset:end])
+        offset = end
+        self.set, self.ID2type = {}, {}
+        # a truncated or corrupt string pool releases the views and the map again
+        try:
+            for _ in range(n_categories):
+                ID = self.mm[offset]
+                name, offset = self.__read_string(offset + 1)
+                count, = BINARY_COUNT.unpack_from(self.mm, offset)
+                offset += BINARY_COUNT.size
+                entries = []
+                for _ in range(count):
+                    entry, offset = self.__read_string(offset)
+                    entries.append(entry)
+                self.set[ID], self.ID2type[ID] = entries, name
+        except (struct.error, IndexError, UnicodeDecodeError):
+            self.close()
+            raise error from None
+
+    def __read_string(self, offset):
+        length, = BINARY_COUNT.unpack_from(self.mm, offset)
+        offset += BINARY_COUNT.size
+        if offset + length > len(self.mm):
+            raise IndexError('string runs past the end of the file')
+        return str(self.view[offset:offset + length], 'utf-8'), offset + length
+
+    def lexeme(self, ID, index):
+        return self.set[ID][index]
+
+    def close(self):
+        self.tokens.buffer.release()
+        self.view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TokenStreamWriter:
+    # keeps the on-the-fly .lex file open, flushing every `flush_every` tokens
+    # or once `flush_interval` seconds have passed since the last flush
+    # the interval is measured between writes, so the lexer also flushes before each read of its input,
+    # which may block, rather than hold the tokens of the last chunk back until the next one arrives
+    def __init__(self, lex_path, flush_every=256, flush_interval=1.0, timestamps=True):
+        self.file = open(lex_path, 'w')
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.timestamps = timestamps
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, ID, index):
+        if self.timestamps:
+            self.file.write('{} <{},{}>\n'.format(datetime.datetime.now(), ID, index))
+        else:
+            self.file.write('<%d,%d>\n' % (ID, index))
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()  # flushed even when lexing fails halfway
+
+
+class TokenCollection:
+    def __init__(self, keywords, lex_path, set_path, write_on_the_fly=False,
+                 flush_every=256, flush_interval=1.0, timestamps=True, keep_list=True):
+        self.keywords = InternTable(keywords)
+        self.type2ID = {
+            'constant_end': 10,
+            'str_end': 20,
+            'symbol_end': 30,
+            'comment_end': 40,
+            'identifier_end': 50,
+            'keyword_end': 60,
+        }
+        self.ID2type = {self.type2ID[key]: key for key in self.type2ID}
+        self.set = {self.type2ID[key]: InternTable() for key in self.type2ID}
+        self.set[self.type2ID['keyword_end']] = self.keywords
+        self.list = []
+        self.keep_list = keep_list  # without it only the symbol table grows, the token list is streamed
+        self.write_on_the_fly = write_on_the_fly
+        self.lex_path = lex_path
+        self.set_path = set_path
+        self.writer = None
+        if self.write_on_the_fly:
+            with open(self.set_path, 'w'):
+                pass  # wipe the file
+            self.writer = TokenStreamWriter(self.lex_path, flush_every, flush_interval, timestamps)
+
+    def append(self, token, accepted_state):
+        # keywords arrive as keyword_end, recognized by the automaton (see ParserAutomaton), not looked up here
+        ID = self.type2ID[accepted_state]
+        index = self.set[ID].intern(token)
+        if self.keep_list:
+            self.list.append((ID, index))
+        if self.writer:
+            self.writer.write(ID, index)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write_set(self, set_path=None):
+        set_path = set_path if set_path else self.set_path
+        with open(set_path, 'w') as fo:
+            for ID in self.set:
+                fo.write('%d: %s\n' % (ID, self.ID2type[ID]))
+                for index, entry in enumerate(self.set[ID]):
+                    fo.write('    %d: %s\n' % (index, entry))
+
+    def write_binary(self, path):
+        with open(path, 'wb') as fo:
+            fo.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(self.set), len(self.list)))
+            record = BINARY_RECORD.pack
+            fo.write(b''.join([record(*_) for _ in self.list]))
+            for ID in self.set:
+                entries = self.set[ID]
+                chunks = [bytes([ID]), self.__pack_string(self.ID2type[ID]), BINARY_COUNT.pack(len(entries))]
+                chunks += [self.__pack_string(entry) for entry in entries]
+                fo.write(b''.join(chunks))
+
+    @staticmethod
+    def __pack_string(string):
+        string = string.encode('utf-8')
+        return BINARY_COUNT.pack(len(string)) + string
+
+    def write_list(self, lex_path=None):
+        lex_path = lex_path if lex_path else self.lex_path
+        with open(lex_path, 'w') as fo:
+            fo.writelines(["<%d,%d>\n" % _ for _ in self.list])
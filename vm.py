@@ -0,0 +1,242 @@
+import argparse
+import sys
+from bytecode import (LOAD_CONST, LOAD_GLOBAL, STORE_GLOBAL, LOAD_LOCAL, STORE_LOCAL, LOAD_OUTER, STORE_OUTER,
+                      LOAD_ELEM_GLOBAL, STORE_ELEM_GLOBAL, LOAD_ELEM_LOCAL, STORE_ELEM_LOCAL, LOAD_ELEM_OUTER,
+                      STORE_ELEM_OUTER, ADD, SUB, MUL, DIV, NEG, LT, LE, GT, GE, EQ, NE, AND, OR, NOT,
+                      JUMP, JUMP_IF_FALSE, CALL, RETURN, READ, WRITE, HALT, OPNAMES, CompileError, compile_program)
+
+
+class VMError(RuntimeError):
+    pass
+
+
+class VM:
+    # stack machine for a compiled Program; a frame is [locals, static link], the program body's locals being the globals
+    # the locals are one flat list per frame, laid out by the slots of the symbol table, an array inline
+    def __init__(self, program, stdin=None, stdout=None, max_depth=10000):
+        self.program = program
+        self.stdin = stdin if stdin is not None else sys.stdin
+        self.stdout = stdout if stdout is not None else sys.stdout
+        self.max_depth = max_depth
+        self.words = iter(())
+        self.globals = None
+
+    def read(self, type):
+        word = next(self.words, None)
+        while word is None:
+            line = self.stdin.readline()
+            if not line:
+                raise VMError('read past the end of input')
+            self.words = iter(line.split())
+            word = next(self.words, None)
+        try:
+            return (int, float, lambda w: w.lower() == 'true', str)[type](word)
+        except ValueError:
+            raise VMError('cannot read %r as %s' % (word, ('integer', 'real', 'bool', 'char')[type]))
+
+    def run(self):
+        program = self.program
+        code, constants, procedures = program.code.tolist(), program.constants, program.procedures
+        self.globals = globals_ = list(program.globals)
+        frame = [globals_, None]
+        locals_ = globals_
+        stack, calls = [], []
+        push, pop = stack.append, stack.pop
+        write = self.stdout.write
+        pc = 0
+        try:
+            while True:
+                op = code[pc]
+                if op == LOAD_LOCAL:
+                    push(locals_[code[pc + 1]])
+                    pc += 2
+                elif op == LOAD_GLOBAL:
+                    push(globals_[code[pc + 1]])
+                    pc += 2
+                elif op == LOAD_CONST:
+                    push(constants[code[pc + 1]])
+                    pc += 2
+                elif op == STORE_LOCAL:
+                    locals_[code[pc + 1]] = pop()
+                    pc += 2
+                elif op == STORE_GLOBAL:
+                    globals_[code[pc + 1]] = pop()
+                    pc += 2
+                elif op == JUMP_IF_FALSE:
+                    pc = pc + 2 if pop() else code[pc + 1]
+                elif op == JUMP:
+                    pc = code[pc + 1]
+                elif op == ADD:
+                    b = pop()
+                    stack[-1] = stack[-1] + b
+                    pc += 1
+                elif op == SUB:
+                    b = pop()
+                    stack[-1] = stack[-1] - b
+                    pc += 1
+                elif op == LE:
+                    b = pop()
+                    stack[-1] = stack[-1] <= b
+                    pc += 1
+                elif op == LT:
+                    b = pop()
+                    stack[-1] = stack[-1] < b
+                    pc += 1
+                elif op == GT:
+                    b = pop()
+                    stack[-1] = stack[-1] > b
+                    pc += 1
+                elif op == GE:
+                    b = pop()
+                    stack[-1] = stack[-1] >= b
+                    pc += 1
+                elif op == EQ:
+                    b = pop()
+                    stack[-1] = stack[-1] == b
+                    pc += 1
+                elif op == NE:
+                    b = pop()
+                    stack[-1] = stack[-1] != b
+                    pc += 1
+                elif op == MUL:
+                    b = pop()
+                    stack[-1] = stack[-1] * b
+                    pc += 1
+                elif op == DIV:
+                    # floor division on two integers, see bytecode.py
+                    b = pop()
+                    a = stack[-1]
+                    stack[-1] = a // b if a.__class__ is int and b.__class__ is int else a / b
+                    pc += 1
+                elif op == NEG:
+                    stack[-1] = -stack[-1]
+                    pc += 1
+                elif op == AND:
+                    b = pop()
+                    stack[-1] = bool(stack[-1] and b)
+                    pc += 1
+                elif op == OR:
+                    b = pop()
+                    stack[-1] = bool(stack[-1] or b)
+                    pc += 1
+                elif op == NOT:
+                    stack[-1] = not stack[-1]
+                    pc += 1
+                elif op == LOAD_ELEM_LOCAL or op == LOAD_ELEM_GLOBAL:
+                    i = stack[-1]
+                    if not 0 <= i < code[pc + 2]:
+                        raise VMError('array index out of bounds')
+                    stack[-1] = (locals_ if op == LOAD_ELEM_LOCAL else globals_)[code[pc + 1] + i]
+                    pc += 3
+                elif op == STORE_ELEM_LOCAL or op == STORE_ELEM_GLOBAL:
+                    value, i = pop(), pop()
+                    if not 0 <= i < code[pc + 2]:
+                        raise VMError('array index out of bounds')
+                    (locals_ if op == STORE_ELEM_LOCAL else globals_)[code[pc + 1] + i] = value
+                    pc += 3
+                elif op == LOAD_OUTER:
+                    outer = frame
+                    for _ in range(code[pc + 1]):
+                        outer = outer[1]
+                    push(outer[0][code[pc + 2]])
+                    pc += 3
+                elif op == STORE_OUTER:
+                    outer = frame
+                    for _ in range(code[pc + 1]):
+                        outer = outer[1]
+                    outer[0][code[pc + 2]] = pop()
+                    pc += 3
+                elif op == LOAD_ELEM_OUTER:
+                    outer = frame
+                    for _ in range(code[pc + 1]):
+                        outer = outer[1]
+                    i = stack[-1]
+                    if not 0 <= i < code[pc + 3]:
+                        raise VMError('array index out of bounds')
+                    stack[-1] = outer[0][code[pc + 2] + i]
+                    pc += 4
+                elif op == STORE_ELEM_OUTER:
+                    outer = frame
+                    for _ in range(code[pc + 1]):
+                        outer = outer[1]
+                    value, i = pop(), pop()
+                    if not 0 <= i < code[pc + 3]:
+                        raise VMError('array index out of bounds')
+                    outer[0][code[pc + 2] + i] = value
+                    pc += 4
+                elif op == CALL:
+                    procedure = procedures[code[pc + 1]]
+                    link = frame
+                    for _ in range(code[pc + 2]):
+                        link = link[1]
+                    n = procedure.n_params
+                    # the arguments become the first locals, followed by the initial values of the rest
+                    locals_ = stack[len(stack) - n:]
+                    del stack[len(stack) - n:]
+                    if len(calls) >= self.max_depth:
+                        raise VMError('call stack overflow in %s' % procedure.name)
+                    calls.append((pc + 3, frame))
+                    locals_ += procedure.template[n:]
+                    frame = [locals_, link]
+                    pc = procedure.entry
+                elif op == RETURN:
+                    pc, frame = calls.pop()
+                    locals_ = frame[0]
+                elif op == WRITE:
+                    value = pop()
+                    write(('true' if value else 'false') if value.__class__ is bool else str(value))
+                    pc += 1
+                elif op == READ:
+                    push(self.read(code[pc + 1]))
+                    pc += 2
+                elif op == HALT:
+                    return globals_
+                else:
+                    raise VMError('bad opcode %d' % op)
+        except (ZeroDivisionError, TypeError) as e:
+            raise VMError('%s at %d (%s)' % (e, pc, OPNAMES[code[pc]]))
+
+
+def main(argv=None):
+    from simple_analyzer import SimpleCompiler
+    from optimizer import optimize
+    from FlatSyntaxTree import TreeFile
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--input", required=True,
+                            help='path to input source file of simple language, or to a saved .sast tree')
+    arg_parser.add_argument("--dis", action='store_true', help='print the bytecode instead of running it')
+    arg_parser.add_argument("--optimize", action='store_true', help='fold constants and drop dead branches first')
+    opt = arg_parser.parse_args(argv)
+
+    tree = None
+    if opt.input.endswith('.sast'):
+        tree = TreeFile(opt.input)
+        root, symbols = tree.node(), None  # the compiler rebuilds the symbol table
+    else:
+        compiler = SimpleCompiler()
+        with open(opt.input) as f:
+            root = compiler.parse(f)
+        symbols = compiler.symbols
+    try:
+        if root is None:
+            sys.exit('syntax error in %s' % opt.input)
+        if opt.optimize:
+            root = optimize(root)
+        program = compile_program(root, symbols)
+    except CompileError as e:
+        sys.exit('%s: %s' % (opt.input, e))
+    finally:
+        if tree is not None:
+            tree.close()  # the nodes of a .sast tree are read from its map until compiled
+    if opt.dis:
+        print(program.disassemble())
+    else:
+        try:
+            VM(program).run()
+        except VMError as e:
+            sys.exit('%s: %s' % (opt.input, e))
+
+
+if __name__ == "__main__":
+    main()